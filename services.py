@@ -1,6 +1,9 @@
 
 import os
+import time
 import httplib2
+import threading
+from apiclient import errors
 from apiclient import discovery
 from oauth2client import tools
 from oauth2client import client
@@ -10,6 +13,9 @@ _APP_NAME = 'Scheduler'
 _SECRET_DIR = 'credentials'
 _APP_SECRET = 'scheduler_secret.json'
 _CLIENT_SECRET = 'client_secret.json'
+_DISCOVERY_DIR = 'discovery'
+_DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/{api}/{apiVersion}/rest'
+_DISCOVERY_MAX_AGE = 7 * 24 * 60 * 60
 
 GMAIL = {
     'name': 'gmail',
@@ -35,11 +41,21 @@ CALENDAR = {
     'kwargs': {}
 }
 
+DRIVE = {
+    'name': 'drive',
+    'scope': 'https://www.googleapis.com/auth/drive.metadata.readonly',
+    'args': ['drive', 'v3'],
+    'kwargs': {}
+}
+
 class ServiceProvider(object):
 
     def __init__(self, *service_defs):
         self._credentials = self.fetch_credentials(*service_defs)
-        self._services = {s['name']: self.create_service(s) for s in service_defs}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._service_defs = {s['name']: s for s in service_defs}
+        self._services = {}
 
     def fetch_credentials(self, *service_defs):
         ''' Acquires OAuth2 credentials '''
@@ -54,24 +70,71 @@ class ServiceProvider(object):
         store = Storage(credential_path)
         credentials = store.get()
 
-        # Create new credentials on failure
-        if not credentials or credentials.invalid:
+        # Create new credentials on failure, or when a service needs a
+        # scope the saved ones were not granted
+        scopes = [s['scope'] for s in service_defs]
+        if not credentials or credentials.invalid or not credentials.has_scopes(scopes):
             client_path = os.path.join(credential_dir, _CLIENT_SECRET)
-            scopes = [s['scope'] for s in service_defs]
             flow = client.flow_from_clientsecrets(client_path, scopes)
             flow.user_agent = _APP_NAME
             credentials = tools.run_flow(flow, store)
 
         return credentials
 
+    def fetch_discovery(self, service_def):
+        ''' Acquires a discovery document, preferring the copy on disk '''
+
+        discovery_dir = os.path.join(os.getcwd(), _SECRET_DIR, _DISCOVERY_DIR)
+        if not os.path.exists(discovery_dir):
+            os.makedirs(discovery_dir)
+        discovery_path = os.path.join(discovery_dir, service_def['name'] + '.json')
+
+        # Documents change rarely, so a cached copy is good for a week
+        if os.path.exists(discovery_path):
+            age = time.time() - os.path.getmtime(discovery_path)
+            if age < _DISCOVERY_MAX_AGE:
+                with open(discovery_path) as f:
+                    return f.read()
+
+        api, version = service_def['args']
+        url = service_def['kwargs'].get('discoveryServiceUrl', _DISCOVERY_URL)
+        url = url.format(api=api, apiVersion=version)
+        response, content = httplib2.Http().request(url)
+        if response.status >= 400:
+            raise errors.HttpError(response, content, uri=url)
+
+        document = content.decode('utf-8')
+        with open(discovery_path + '.tmp', 'w') as f:
+            f.write(document)
+        os.replace(discovery_path + '.tmp', discovery_path)
+
+        return document
+
     def create_service(self, service_def):
-        ''' Initially creates a service '''
+        ''' Initially creates a service from its discovery document '''
 
-        authorization = self._credentials.authorize(httplib2.Http())
-        service_def['kwargs']['http'] = authorization
-        return discovery.build(*service_def['args'], **service_def['kwargs'])
+        document = self.fetch_discovery(service_def)
+        return discovery.build_from_document(document, http=self.get_http())
 
     def get_service(self, service_name):
-        ''' Gets a service from the cache '''
-
-        return self._services[service_name]
\ No newline at end of file
+        ''' Gets a service from the cache, creating it on first use '''
+
+        with self._lock:
+            if service_name not in self._services:
+                service_def = self._service_defs[service_name]
+                self._services[service_name] = self.create_service(service_def)
+            return self._services[service_name]
+
+    def get_http(self):
+        ''' Gets an authorized transport for the calling thread
+
+        httplib2 connections are not thread-safe, so each thread keeps one
+        connection that all services share; requests executed from worker
+        threads pass this as execute(http=...).
+        '''
+
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._credentials.authorize(httplib2.Http())
+            self._local.http = http
+        return http
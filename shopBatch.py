@@ -0,0 +1,143 @@
+import time
+import random
+import httplib2
+import threading
+
+from concurrent import futures
+
+from apiclient import errors
+
+import shopTrace
+
+# Google limits batch requests to 50 calls for most APIs
+_BATCH_SIZE = 50
+
+# Rate limits and server errors are worth another try
+_RETRY_STATUS = {403, 429, 500, 502, 503, 504}
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity=None):
+        ''' Allows rate calls per second, in bursts of up to capacity '''
+
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        ''' Blocks until a call may be made '''
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class BatchWriter(object):
+
+    def __init__(self, service, http=None, batch_size=_BATCH_SIZE,
+                 workers=4, retries=5, backoff=1.0, rate=None, name='batch'):
+        ''' Executes requests against a service in batches
+
+        http returns an authorized transport for the calling thread; without
+        it batches are sent one after another. Failed calls are retried one
+        at a time, waiting backoff * 2^n seconds (with jitter) between tries.
+        rate caps the calls per second across all workers, retries included.
+        name labels the calls in the trace.
+        '''
+
+        self.service = service
+        self.http = http
+        self.batch_size = batch_size
+        self.workers = workers if http else 1
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = TokenBucket(rate) if rate else None
+        self.name = name
+
+    def execute(self, requests, done=None):
+        ''' Executes (key, request) pairs and reports on each key
+
+        Each report entry holds 'ok', 'attempts' and the final 'response'
+        or 'error' for that request. done(key, entry) is called from the
+        calling thread as each batch finishes.
+        '''
+
+        requests = [(key, request) for key, request in requests if request]
+        chunks = [requests[i:i + self.batch_size]
+                  for i in range(0, len(requests), self.batch_size)]
+
+        report = {}
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for result in pool.map(self.executeBatch, chunks):
+                report.update(result)
+                if done:
+                    for key, entry in result.items():
+                        done(key, entry)
+
+        return report
+
+    def throttle(self, calls=1):
+        ''' Waits until the rate limit allows the given number of calls '''
+
+        if self.bucket:
+            for _ in range(calls):
+                self.bucket.acquire()
+
+    def executeBatch(self, chunk):
+        ''' Sends one batch, then retries its failures individually '''
+
+        http = self.http() if self.http else None
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for i, (key, request) in enumerate(chunk):
+            batch.add(request, request_id=str(i))
+
+        # A failed batch leaves every call in it to be retried
+        failure = None
+        self.throttle(len(chunk))
+        try:
+            shopTrace.trace.execute(self.name + ':batch', batch, http=http)
+        except (errors.HttpError, httplib2.HttpLib2Error, OSError) as error:
+            failure = error
+
+        report = {}
+        for i, (key, request) in enumerate(chunk):
+            response, error = results.get(str(i), (None, failure))
+            attempts = 1
+            while error is not None and attempts <= self.retries and self.isRetryable(error):
+                time.sleep(self.backoff * 2 ** (attempts - 1) * (1 + random.random()))
+                attempts += 1
+                self.throttle()
+                try:
+                    response = shopTrace.trace.execute(self.name, request, http=http)
+                    error = None
+                except (errors.HttpError, httplib2.HttpLib2Error, OSError) as e:
+                    error = e
+
+            report[key] = {
+                'ok': error is None,
+                'attempts': attempts,
+                'response': response,
+                'error': error,
+            }
+
+        return report
+
+    def isRetryable(self, error):
+        ''' Determines whether a failed call may succeed if tried again '''
+
+        if isinstance(error, errors.HttpError):
+            return int(error.resp.status) in _RETRY_STATUS
+        return True
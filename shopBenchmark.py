@@ -0,0 +1,236 @@
+import shopFake
+import shopModel
+import shopShift
+import shopSolver
+import shopScheduler
+
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import contextlib
+import subprocess
+
+import ortools
+
+from ortools.sat.python import cp_model
+
+def makeShifts(count, anchor, rng):
+    ''' Generates a synthetic week of shifts starting at anchor '''
+
+    calendars = shopFake.makeEvents(count, anchor, rng)
+    shifts = []
+    for events in calendars.values():
+        for event in events:
+            if 'dateTime' in event['start']:
+                shifts.append(shopShift.Shift(event, cutoff=anchor))
+
+    return shifts
+
+def buildBefore(targets, hours, availability, conflicts):
+    ''' Builds the model with one window per tech and shift '''
+
+    shop_model = shopModel.ShopModel(targets, hours, availability, [])
+    model = shop_model.model
+    for vars in shop_model.tech_vars:
+        for s, last in enumerate(conflicts):
+            terms = [vars[c] for c in range(s, last) if c in vars]
+            if terms:
+                model.AddLinearConstraint(cp_model.LinearExpr.Sum(terms), 0, 1)
+
+    return shop_model
+
+def buildAfter(targets, hours, availability, conflicts):
+    ''' Builds the model with one constraint per maximal window '''
+
+    windows = shopModel.ShopModel.parseWindows(conflicts)
+    return shopModel.ShopModel(targets, hours, availability, windows)
+
+def benchmarkWindows(num_shifts, num_techs, density, seed):
+    ''' Times both model builds on one synthetic week '''
+
+    rng = random.Random(seed)
+    anchor = datetime.datetime(2018, 1, 1)
+    shifts = makeShifts(num_shifts, anchor, rng)
+    overlaps, conflicts = shopModel.ShopModel.parseConflicts(shifts)
+
+    targets = [rng.randrange(0, 21) for _ in range(num_techs)]
+    hours = [shift.hours for shift in shifts]
+    availability = [[rng.random() < density for _ in range(num_techs)]
+                    for _ in shifts]
+
+    results = []
+    for name, build in [('before', buildBefore), ('after', buildAfter)]:
+        start = time.perf_counter()
+        shop_model = build(targets, hours, availability, conflicts)
+        elapsed = time.perf_counter() - start
+        results.append((name, elapsed, len(shop_model.model.Proto().constraints)))
+
+    return results
+
+class Timer(object):
+
+    def __init__(self):
+        ''' Collects wall times for named stages '''
+
+        self.stages = {}
+
+    def time(self, name, function, *args):
+        ''' Runs function(*args), recording how long it took '''
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(*args)
+        self.stages[name] = time.perf_counter() - start
+        return result
+
+def benchmarkStages(num_techs, num_shifts, args):
+    ''' Times the whole pipeline and each of its stages on a synthetic shop '''
+
+    def makeScheduler():
+        provider, config = shopFake.makeShop(
+            num_techs, num_shifts, seed=args.seed, latency=args.latency)
+        options = argparse.Namespace(
+            week=1, weeks=1, workers=args.workers, time_limit=args.time_limit,
+            gap=args.gap, weighted=False, decompose=None, fast=False, dry=True,
+            progress=None, stall=0, accept=False,
+            from_snapshot=None, no_cache=True, sync=False)
+        return shopScheduler.ShopScheduler(options, provider, config), provider.backend
+
+    def runPipeline():
+        scheduler, backend = makeScheduler()
+        scheduler.schedule()
+        scheduler.calendar.postEvents(scheduler.roster.techs)
+
+    timer = Timer()
+    timer.time('pipeline', runPipeline)
+
+    scheduler, backend = timer.time('fetch', makeScheduler)
+    calendar = scheduler.calendar
+    events = [dict(e) for items in backend.events.values() for e in items.values()]
+    shifts = list(calendar.shifts)
+
+    timer.time('parseTechs', scheduler.roster.parseTechs, backend.rows)
+    timer.time('parseShifts', calendar.parseShifts, events)
+    timer.time('parseConflicts', shopModel.ShopModel.parseConflicts, shifts)
+    timer.time('parseAvailability', shopModel.ShopModel.parseAvailability,
+               shifts, scheduler.roster.techs)
+
+    availability, conflicts = timer.time('prepare', scheduler.prepare)
+    shop_model = timer.time('buildModel', scheduler.buildModel, availability, conflicts)
+
+    shop_solver = shopSolver.ShopSolver(
+        shop_model, workers=args.workers, time_limits=args.time_limit, gap=args.gap)
+    solver = timer.time('solve', shop_solver.solve)
+    for phase in shop_solver.phases:
+        timer.stages['solve:' + phase['phase']] = phase['seconds']
+
+    timer.time('assign', scheduler.assign, shop_model.assignment(solver), availability, conflicts)
+    calls = dict(backend.calls)
+    timer.time('postEvents', calendar.postEvents, scheduler.roster.techs)
+
+    proto = shop_model.model.Proto()
+    return {
+        'techs': num_techs,
+        'shifts': num_shifts,
+        'stages': timer.stages,
+        'variables': len(proto.variables),
+        'constraints': len(proto.constraints),
+        'filled': sum(shift.tech is not None for shift in calendar.shifts),
+        'phases': [p['status'] for p in shop_solver.phases],
+        'patches': backend.calls.get('patchEvent', 0) - calls.get('patchEvent', 0),
+    }
+
+def describeRun():
+    ''' Identifies the code and environment a set of results came from '''
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'ortools': ortools.__version__,
+        'machine': platform.machine(),
+    }
+
+def compareResults(old, new):
+    ''' Prints how each stage's time changed between two sets of results '''
+
+    previous = {(r['techs'], r['shifts']): r for r in old['results']}
+    print('{:>6} {:>6} {:<20} {:>10} {:>10} {:>7}'.format(
+        'techs', 'shifts', 'stage', 'old (s)', 'new (s)', 'ratio'))
+    for result in new['results']:
+        before = previous.get((result['techs'], result['shifts']))
+        if not before:
+            continue
+        for stage, seconds in result['stages'].items():
+            if stage not in before['stages']:
+                continue
+            old_seconds = before['stages'][stage]
+            print('{:>6} {:>6} {:<20} {:>10.3f} {:>10.3f} {:>7.2f}'.format(
+                result['techs'], result['shifts'], stage, old_seconds, seconds,
+                seconds / old_seconds if old_seconds else float('inf')))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the scheduler on synthetic shops',
+        epilog='Brought to you by Scarborough'
+    )
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    windows = commands.add_parser('windows', help='compare same-day constraint builds')
+    windows.add_argument('-s', '--shifts', type=int, nargs='+', default=[100, 500, 2000], help='shifts per synthetic week')
+    windows.add_argument('-t', '--techs', type=int, default=40, help='techs on the synthetic roster')
+    windows.add_argument('--density', type=float, default=0.3, help='fraction of shifts each tech can work')
+    windows.add_argument('--seed', type=int, default=0, help='random seed')
+
+    stages = commands.add_parser('stages', help='time each stage of a full run')
+    stages.add_argument('-s', '--shifts', type=int, nargs='+', default=[100, 500], help='shifts per synthetic week')
+    stages.add_argument('-t', '--techs', type=int, nargs='+', default=[50, 200], help='techs on the synthetic roster')
+    stages.add_argument('-w', '--workers', type=int, default=0, help='CP-SAT search workers (0 picks automatically)')
+    stages.add_argument('-l', '--time-limit', type=float, nargs='+', default=[10], help='seconds allowed per solve phase')
+    stages.add_argument('-g', '--gap', type=float, default=0.0, help='relative gap at which a phase stops')
+    stages.add_argument('--latency', type=float, default=0.0, help='seconds added to each fake API round trip')
+    stages.add_argument('--seed', type=int, default=0, help='random seed')
+    stages.add_argument('-o', '--output', help='write JSON results here instead of stdout')
+    stages.add_argument('-c', '--compare', help='JSON results from an earlier run to compare against')
+    args = parser.parse_args()
+
+    if args.command == 'windows':
+        print('{:>6} {:>6} {:>7} {:>10} {:>12}'.format(
+            'shifts', 'techs', 'model', 'build (s)', 'constraints'))
+        for num_shifts in args.shifts:
+            for name, elapsed, constraints in benchmarkWindows(
+                    num_shifts, args.techs, args.density, args.seed):
+                print('{:>6} {:>6} {:>7} {:>10.3f} {:>12}'.format(
+                    num_shifts, args.techs, name, elapsed, constraints))
+
+    if args.command == 'stages':
+        results = {'run': describeRun(), 'results': []}
+        for num_techs in args.techs:
+            for num_shifts in args.shifts:
+                results['results'].append(benchmarkStages(num_techs, num_shifts, args))
+                print('{} techs, {} shifts done'.format(num_techs, num_shifts), file=sys.stderr)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+
+        if args.compare:
+            with open(args.compare) as f:
+                compareResults(json.load(f), results)
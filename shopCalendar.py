@@ -1,50 +1,195 @@
+import os
 import bisect
 import datetime
 
+from concurrent import futures
+
+from apiclient import errors
+
+import shopBatch
 import shopShift
+import shopTrace
+import shopSnapshot
+
+# Only the parts of an event that Shift reads or writes
+_EVENT_FIELDS = 'nextPageToken,items(id,etag,summary,description,start,end,organizer)'
+
+# Syncing also needs the token for next time and which events were deleted
+_SYNC_FIELDS = ('nextPageToken,nextSyncToken,'
+                'items(id,etag,status,summary,description,start,end,organizer)')
 
 class ShopCalendar(object):
 
-    def __init__(self, gcalendar, cal_ids, anchor, week):
+    def __init__(self, gcalendar, cal_ids, anchor, week, http=None, weeks=1, shifts=None,
+                 sync=None, arrived=None):
+        ''' Loads the shifts of the weeks being scheduled
+
+        Shifts already loaded, as from a snapshot, are used as they are.
+        sync names a file holding every calendar's events and sync token;
+        when given, only the changes since the last run are fetched.
+        arrived(cal_id, shifts) is called with each calendar's shifts as
+        soon as they are parsed, while the rest are still being fetched.
+        '''
 
         self.gcalendar = gcalendar
         self.cal_ids = cal_ids
         self.anchor = anchor
         self.week = week
+        self.weeks = weeks
+        self.http = http
+        self.sync = sync
+        self.arrived = arrived
 
         self.cutoff = datetime.datetime.strptime(self.anchor, '%Y-%m-%d')
         self.cutoff += datetime.timedelta(days = 7 * week) 
-        self.getAllShifts(cal_ids, anchor, week)
+        if shifts is not None:
+            self.shifts = shifts
+            return
+        with shopTrace.trace.stage('calendar:fetch'):
+            self.getAllShifts(cal_ids, anchor, week)
 
     def getAllShifts(self, cal_ids, anchor, week):
-        ''' Retrieves all shifts from Google Calendar '''
+        ''' Retrieves all shifts from Google Calendar
+
+        Every week being scheduled comes back in the one pass. Shifts are
+        returned in the order of cal_ids, whatever order they arrive in.
+        '''
 
         min_time = self.getWeek(week)
-        max_time = self.getWeek(week + 1)
-
-        shifts = []
-        for cal_id in cal_ids:
-            
-            request = self.gcalendar.events().list(
-                calendarId=cal_id,
-                timeMin=min_time,
-                timeMax=max_time,
-                singleEvents=True)
-        
-            result = request.execute()
-
-            for item in result['items']:
-                try: 
-                    shift = shopShift.Shift(item, cutoff=self.cutoff)
-                    shifts.append(shift)
-                # All-day events throw KeyErrors and are not shifts
-                except KeyError:
-                    continue
-        
+        max_time = self.getWeek(week + self.weeks)
+
+        # Calendars are fetched side by side when each thread can have its
+        # own connection
+        workers = max(len(cal_ids), 1) if self.http else 1
+        with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            if self.sync:
+                fetched = zip(cal_ids, self.syncAllEvents(pool, cal_ids, min_time, max_time))
+            else:
+                pending = {pool.submit(self.getEvents, cal_id, min_time, max_time): cal_id
+                           for cal_id in cal_ids}
+                fetched = ((pending[future], future.result())
+                           for future in futures.as_completed(pending))
+
+            # Each calendar is parsed and handed on while the others download
+            by_cal = {}
+            for cal_id, items in fetched:
+                by_cal[cal_id] = self.parseShifts(items)
+                if self.arrived:
+                    self.arrived(cal_id, by_cal[cal_id])
+
+        shifts = [shift for cal_id in cal_ids for shift in by_cal[cal_id]]
         self.shifts = shifts
         
         return shifts
 
+    def syncAllEvents(self, pool, cal_ids, min_time, max_time):
+        ''' Brings the synced copy of each calendar up to date
+
+        Returns the events falling within the weeks being scheduled.
+        '''
+
+        state = {}
+        if os.path.exists(self.sync):
+            try:
+                state = shopSnapshot.loadState(self.sync)['calendars']
+            except (OSError, ValueError):
+                state = {}
+
+        synced = pool.map(lambda cal_id: self.syncEvents(cal_id, state.get(cal_id)), cal_ids)
+        state = dict(zip(cal_ids, synced))
+        shopSnapshot.saveState(self.sync, {'calendars': state})
+
+        start = self.parseTime(min_time)
+        end = self.parseTime(max_time)
+        return [[event for event in state[cal_id]['events'].values()
+                 if self.parseTime(event['start']) < end and self.parseTime(event['end']) > start]
+                for cal_id in cal_ids]
+
+    def syncEvents(self, cal_id, synced=None):
+        ''' Applies the changes to a calendar since it was last synced
+
+        synced holds the calendar's events by id and the sync token that
+        ends them. Without it, or once Google expires the token, every
+        event is fetched again. Sync tokens cannot be combined with a time
+        window, so the window is applied locally.
+        '''
+
+        if synced and not synced.get('token'):
+            synced = None
+
+        http = self.http() if self.http else None
+        events = self.gcalendar.events()
+        kwargs = {}
+        if synced:
+            kwargs['syncToken'] = synced['token']
+        request = events.list(
+            calendarId=cal_id,
+            singleEvents=True,
+            maxResults=2500,
+            fields=_SYNC_FIELDS,
+            **kwargs)
+
+        items = dict(synced['events']) if synced else {}
+        token = None
+        try:
+            while request is not None:
+                result = shopTrace.trace.execute('calendar.events.sync', request, http=http)
+                for item in result.get('items', []):
+                    if item.get('status') == 'cancelled':
+                        items.pop(item['id'], None)
+                    else:
+                        items[item['id']] = item
+                token = result.get('nextSyncToken', token)
+                request = events.list_next(request, result)
+        except errors.HttpError as error:
+            if not synced or int(error.resp.status) != 410:
+                raise
+            return self.syncEvents(cal_id)
+
+        return {'token': token, 'events': items}
+
+    @staticmethod
+    def parseTime(value):
+        ''' Parses an event time or query bound as local time
+
+        All-day events have a date rather than a time.
+        '''
+
+        if isinstance(value, dict):
+            value = value.get('dateTime', value.get('date'))
+        return datetime.datetime.fromisoformat(value[:19])
+
+    def parseShifts(self, items):
+        ''' Creates shifts from calendar events '''
+
+        return shopShift.ShiftTable.fromEvents(items).shifts(cutoff=self.cutoff)
+
+    def getEvents(self, cal_id, min_time, max_time):
+        ''' Retrieves every page of events in one calendar '''
+
+        http = self.http() if self.http else None
+        events = self.gcalendar.events()
+        request = events.list(
+            calendarId=cal_id,
+            timeMin=min_time,
+            timeMax=max_time,
+            singleEvents=True,
+            maxResults=2500,
+            fields=_EVENT_FIELDS)
+
+        items = []
+        while request is not None:
+            result = shopTrace.trace.execute('calendar.events.list', request, http=http)
+            items.extend(result.get('items', []))
+            request = events.list_next(request, result)
+
+        return items
+
+    def getWeekIndex(self, shift):
+        ''' Returns which of the weeks being scheduled a shift falls in '''
+
+        return (shift.start - self.cutoff).days // 7
+
     def getWeek(self, num_weeks):
         ''' Returns a date offset from self.anchor by num_weeks '''
 
@@ -53,28 +198,27 @@ class ShopCalendar(object):
         return week.strftime('%Y-%m-%dT%H:%M:%S-07:00')
 
     def postEvents(self, techs):
-        ''' Posts all shifts to Google Calendar '''
+        ''' Posts changed shifts to Google Calendar, reporting on each one '''
 
-        requests = [shift.postEvent(self.gcalendar, techs) for shift in self.shifts]
-        #batch = self.gcalendar.new_batch_http_request()
-        for request in requests:
-            if request:
-                request.execute()
-                #batch.add(request)
-        #batch.execute()
+        requests = [(shift, shift.postEvent(self.gcalendar, techs)) for shift in self.shifts]
+        return self.writeEvents(requests)
 
     def nukeEvents(self):
-        ''' Resets all shifts in the specified week '''
-
-        for shift in self.shifts:
-            if shift.old:
-                continue
-            
-            event = shift.event
-            event['summary'] = ''
-            event['description'] = ''
-
-            self.gcalendar.events().update(
-                calendarId=event['organizer']['email'],
-                eventId=event['id'],
-                body=event).execute()
+        ''' Resets all shifts in the specified week, reporting on each one '''
+
+        requests = [(shift, shift.patchEvent(self.gcalendar, '', '')) 
+                    for shift in self.shifts if not shift.old]
+        return self.writeEvents(requests)
+
+    def writeEvents(self, requests):
+        ''' Executes event patches and records what the calendar now holds '''
+
+        writer = shopBatch.BatchWriter(
+            self.gcalendar, http=self.http, name='calendar.events.patch')
+        with shopTrace.trace.stage('calendar:write'):
+            report = writer.execute(requests)
+        for shift, result in report.items():
+            if result['ok']:
+                shift.event.update(result['response'])
+
+        return report
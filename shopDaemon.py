@@ -0,0 +1,262 @@
+import shopModel
+import shopShift
+import shopSolver
+import shopScheduler
+import shopTrace
+
+import json
+import time
+import argparse
+
+from http import server
+
+import numpy as np
+
+_DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday',
+              'Friday', 'Saturday', 'Sunday']
+
+class ShopDaemon(object):
+
+    def __init__(self, load, args):
+        ''' Keeps a week in memory and answers what-if questions about it
+
+        load returns a freshly fetched ShopScheduler; args gives the solver
+        settings for every answer. The baseline schedule is solved once and
+        seeds each what-if solve.
+        '''
+
+        self.load = load
+        self.args = args
+        self.reload()
+
+    def reload(self):
+        ''' Fetches the week again and solves its baseline schedule '''
+
+        # The trace only ever covers the latest request, so it cannot grow
+        shopTrace.trace.reset()
+        scheduler = self.load()
+        with shopTrace.trace.stage('prepare'):
+            availability, conflicts = scheduler.prepare()
+
+        self.scheduler = scheduler
+        self.techs = scheduler.roster.techs
+        self.shifts = list(scheduler.calendar.shifts)
+        self.targets = [tech.hours for tech in self.techs]
+        self.availability = scheduler.openShifts(availability)
+        self.names = {tech.getName(): t for t, tech in enumerate(self.techs)}
+        self.added = 0
+
+        start = time.perf_counter()
+        shop_model = scheduler.buildModel(availability, conflicts)
+        shop_solver = shopSolver.ShopSolver(
+            shop_model,
+            workers=self.args.workers,
+            time_limits=self.args.baseline_limit,
+            gap=self.args.gap,
+            verbose=False)
+        assignment = shop_model.assignment(shop_solver.solve())
+
+        self.baseline = {}
+        self.summary = self.describe(self.shifts, self.targets, assignment, {
+            'phases': [phase['status'] for phase in shop_solver.phases],
+            'seconds': round(time.perf_counter() - start, 3)})
+        self.baseline = {id(shift): t for shift, t in zip(self.shifts, assignment)}
+        return self.summary
+
+    def whatIf(self, edits):
+        ''' Repairs the baseline schedule with edits applied to a copy of the week
+
+        Each edit is one of
+            {"block": NAME, "day": "Thursday"}   NAME cannot work that day,
+                                                 or at all without a day
+            {"hours": NAME, "target": 12}        NAME should work 12 hours
+            {"shift": {"cal": CAL, "start": ISO, "end": ISO}}
+                                                 an extra shift is added
+        Only the shifts an edit touches are re-solved, as with --repair, so
+        answers take a fraction of a full solve. Nothing in memory changes.
+        '''
+
+        shopTrace.trace.reset()
+        start = time.perf_counter()
+        shifts = list(self.shifts)
+        targets = list(self.targets)
+        availability = self.availability.copy()
+
+        # Shifts go in first so that blocks apply to them as well
+        added = [self.makeShift(edit['shift']) for edit in edits if 'shift' in edit]
+        if added:
+            shifts += added
+            availability = np.vstack([
+                availability,
+                shopModel.ShopModel.parseAvailability(added, self.techs)])
+            order = sorted(range(len(shifts)), key=lambda s: shifts[s].start)
+            shifts = [shifts[s] for s in order]
+            availability = availability[order]
+
+        # Techs whose hours change give up their shifts to be dealt again
+        released = set()
+        for edit in edits:
+            if 'shift' in edit:
+                continue
+            elif 'block' in edit:
+                t = self.techIndex(edit['block'])
+                day = edit.get('day')
+                if day is not None and day not in _DAY_NAMES:
+                    raise ValueError('Unknown day {}'.format(day))
+                days = np.array([day is None or _DAY_NAMES[shift.start.weekday()] == day
+                                 for shift in shifts], dtype=bool)
+                availability[days, t] = False
+            elif 'hours' in edit:
+                t = self.techIndex(edit['hours'])
+                targets[t] = int(edit['target'])
+                released.add(t)
+            else:
+                raise ValueError('Unknown edit {}'.format(json.dumps(edit)))
+
+        held = [self.baseline.get(id(shift)) for shift in shifts]
+        previous = [None if t in released else t for t in held]
+        _, conflicts = shopModel.ShopModel.parseConflicts(shifts)
+        freed = shopModel.ShopModel.parseRepair(previous, availability, conflicts)
+
+        kept = list(previous)
+        for s in freed:
+            kept[s] = None
+        shopModel.ShopModel.blockKept(availability, conflicts, kept)
+        shop_model = shopModel.ShopModel.repairModel(
+            targets, [shift.hours for shift in shifts], kept, freed, availability, conflicts)
+
+        shop_solver = shopSolver.ShopSolver(
+            shop_model,
+            workers=self.args.workers,
+            time_limits=self.args.time_limit,
+            gap=self.args.gap,
+            verbose=False)
+        solver = shop_solver.solveRepair([previous[s] for s in freed])
+
+        assignment = kept
+        for s, t in zip(freed, shop_model.assignment(solver)):
+            assignment[s] = t
+
+        return self.describe(shifts, targets, assignment, {
+            'freed': len(freed),
+            'phases': [phase['status'] for phase in shop_solver.phases],
+            'seconds': round(time.perf_counter() - start, 3)})
+
+    def makeShift(self, spec):
+        ''' Creates a shift that is not on any calendar '''
+
+        self.added += 1
+        event = {
+            'id': 'whatif{}'.format(self.added),
+            'summary': '',
+            'description': '',
+            'start': {'dateTime': spec['start']},
+            'end': {'dateTime': spec['end']},
+            'organizer': {'displayName': spec['cal'], 'email': spec['cal']}}
+        return shopShift.Shift(event, cutoff=self.scheduler.calendar.cutoff)
+
+    def techIndex(self, name):
+        if name not in self.names:
+            raise ValueError('No tech named {}'.format(name))
+        return self.names[name]
+
+    def describe(self, shifts, targets, assignment, stats):
+        ''' Summarizes a schedule, and how it differs from the baseline '''
+
+        name = lambda t: self.techs[t].getName() if t is not None else None
+        worked = [0 for _ in self.techs]
+        for shift, t in zip(shifts, assignment):
+            if t is not None:
+                worked[t] += shift.hours
+
+        changes = []
+        for shift, t in zip(shifts, assignment):
+            before = self.baseline.get(id(shift))
+            if before != t and self.baseline:
+                changes.append({'shift': str(shift), 'from': name(before), 'to': name(t)})
+
+        return dict(stats, **{
+            'filled': sum(t is not None for t in assignment),
+            'shifts': len(shifts),
+            'deviation': sum(abs(target - worked[t]) for t, target in enumerate(targets)),
+            'unfilled': [str(shift) for shift, t in zip(shifts, assignment) if t is None],
+            'changes': changes,
+            'hours': {name(t): [worked[t], target] for t, target in enumerate(targets)}})
+
+class ShopHandler(server.BaseHTTPRequestHandler):
+    ''' Serves a ShopDaemon as JSON
+
+        GET  /schedule   the baseline schedule
+        POST /whatif     {"edits": [...]}, answered as ShopDaemon.whatIf
+        POST /reload     fetch the week again and re-solve the baseline
+    '''
+
+    shop_daemon = None
+
+    def do_GET(self):
+        if self.path == '/schedule':
+            self.reply(200, self.shop_daemon.summary)
+        else:
+            self.reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/whatif':
+                self.reply(200, self.shop_daemon.whatIf(body.get('edits', [])))
+            elif self.path == '/reload':
+                self.reply(200, self.shop_daemon.reload())
+            else:
+                self.reply(404, {'error': 'Not found'})
+        except (ValueError, KeyError, TypeError) as error:
+            self.reply(400, {'error': str(error)})
+        except RuntimeError as error:
+            self.reply(503, {'error': str(error)})
+
+    def reply(self, status, data):
+        body = json.dumps(data, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Answers what-if questions about a week over local HTTP',
+        epilog='Brought to you by Scarborough'
+    )
+    parser.add_argument('week', type=int, help='week of the quarter')
+    parser.add_argument('-p', '--port', type=int, default=8642, help='port to listen on (localhost only)')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='CP-SAT search workers (0 picks automatically)')
+    parser.add_argument('-l', '--time-limit', type=float, nargs='+', default=[1], help='seconds allowed per phase of each what-if solve')
+    parser.add_argument('-b', '--baseline-limit', type=float, nargs='+', help='seconds allowed per phase of the baseline solve')
+    parser.add_argument('-g', '--gap', type=float, default=0.0, help='stop a phase once within this relative gap of optimal')
+    parser.add_argument('--fake', type=int, nargs=2, metavar=('TECHS', 'SHIFTS'), help='run against a synthetic shop instead of Google')
+    parser.add_argument('--from-snapshot', metavar='PATH', help='load a saved snapshot instead of fetching')
+    parser.add_argument('--sync', action='store_true', help='fetch only what changed since the last sync')
+    parser.set_defaults(weeks=1, weighted=False, decompose=None, fast=False, dry=True,
+                        progress=None, stall=0, accept=False,
+                        repair=False, drop=[], no_cache=False)
+    args = parser.parse_args()
+
+    def load():
+        provider, config = None, None
+        if args.fake:
+            import shopFake
+            provider, config = shopFake.makeShop(*args.fake, week=args.week)
+        return shopScheduler.ShopScheduler(args, provider, config)
+
+    ShopHandler.shop_daemon = ShopDaemon(load, args)
+
+    # Solves use every core, so requests are answered one at a time
+    httpd = server.HTTPServer(('127.0.0.1', args.port), ShopHandler)
+    print('Answering what-ifs for week {} on http://127.0.0.1:{}'.format(args.week, args.port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
@@ -0,0 +1,185 @@
+from concurrent import futures
+
+import numpy as np
+
+import shopModel
+import shopSolver
+import shopHeuristic
+import shopTrace
+
+def findComponents(availability):
+    ''' Splits shifts and techs into groups that share no eligible pairs
+
+    Returns (shifts, techs) index lists for every group holding at least
+    one shift and one tech. Same-day conflicts only ever involve a single
+    tech, so they never join groups.
+    '''
+
+    num_shifts, num_techs = availability.shape
+    parent = list(range(num_shifts + num_techs))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for s, t in zip(*np.nonzero(availability)):
+        a, b = find(int(s)), find(num_shifts + int(t))
+        if a != b:
+            parent[a] = b
+
+    groups = {}
+    for node in range(num_shifts + num_techs):
+        groups.setdefault(find(node), []).append(node)
+
+    components = []
+    for nodes in groups.values():
+        shifts = [n for n in nodes if n < num_shifts]
+        techs = [n - num_shifts for n in nodes if n >= num_shifts]
+        if shifts and techs:
+            components.append((shifts, techs))
+
+    return components
+
+def buildComponent(task):
+    ''' Builds the model for one component '''
+
+    # Conflicts index the full shift list; re-index them within the component
+    conflicts = shopModel.ShopModel.restrictConflicts(task['conflicts'], task['shifts'])
+    return shopModel.ShopModel(
+        task['targets'], task['hours'], task['availability'],
+        shopModel.ShopModel.parseWindows(conflicts),
+        limits=task['limits'], weeks=task['weeks'])
+
+def solveCoverage(task):
+    ''' Fills shifts and matches hours within one component
+
+    A component that finds nothing in time is scheduled by the heuristic
+    instead, as schedule() does for the whole week.
+    '''
+
+    shop_model = buildComponent(task)
+    shop_solver = shopSolver.ShopSolver(shop_model, verbose=False, **task['options'])
+    try:
+        solver = shop_solver.solveCoverage()
+    except RuntimeError:
+        return solveQuick(task, shop_solver.phases)
+
+    return {
+        'assignment': shop_model.assignment(solver),
+        'filled': solver.Value(shop_model.filled),
+        'deviation': solver.Value(shop_model.deviation),
+        'phases': shop_solver.phases}
+
+def solveQuick(task, phases):
+    ''' Schedules one component with the heuristic, scored as solveCoverage '''
+
+    conflicts = shopModel.ShopModel.restrictConflicts(task['conflicts'], task['shifts'])
+    assignment = shopHeuristic.ShopHeuristic(
+        task['targets'], task['hours'], task['availability'], conflicts,
+        limits=task['limits'], weeks=task['weeks']).solve()
+
+    worked = [0 for _ in task['targets']]
+    for s, t in enumerate(assignment):
+        if t is not None:
+            worked[t] += task['hours'][s]
+
+    return {
+        'assignment': assignment,
+        'filled': sum(t is not None for t in assignment),
+        'deviation': sum(abs(target - worked[t]) for t, target in enumerate(task['targets'])),
+        'phases': phases}
+
+def solveSpread(task):
+    ''' Evens out pain within one component, holding coverage fixed '''
+
+    shop_model = buildComponent(task)
+    model = shop_model.model
+    model.Add(shop_model.filled >= task['filled'])
+    model.Add(shop_model.deviation <= task['deviation'])
+    shop_model.hintAssignment(task['assignment'])
+
+    shop_solver = shopSolver.ShopSolver(shop_model, verbose=False, **task['options'])
+
+    # Coverage already holds a schedule if pain finds none in time
+    try:
+        assignment = shop_model.assignment(shop_solver.solveSpread(task['pain']))
+    except RuntimeError:
+        assignment = task['assignment']
+
+    return {
+        'assignment': assignment,
+        'phases': shop_solver.phases}
+
+class ShopDecomposer(object):
+
+    def __init__(self, targets, hours, availability, conflicts, processes=None, weeks=None, **options):
+        ''' Solves independent parts of a week in parallel processes
+
+        Arguments match ShopModel, except conflicts is the list from
+        parseConflicts; options go to each component's ShopSolver.
+        '''
+
+        self.targets = targets
+        self.hours = hours
+        self.weeks = weeks if weeks is not None else [0 for _ in hours]
+        self.availability = np.asarray(availability, dtype=bool)
+        self.conflicts = conflicts
+        self.processes = processes
+        self.options = options
+
+    def makeTask(self, shifts, techs):
+        ''' Packs one component's slice of the inputs for a worker '''
+
+        return {
+            'shifts': shifts,
+            'targets': [self.targets[t] for t in techs],
+            'hours': [self.hours[s] for s in shifts],
+            'weeks': [self.weeks[s] for s in shifts],
+            'limits': [[20] * (max(self.weeks, default=0) + 1) for _ in techs],
+            'availability': self.availability[np.ix_(shifts, techs)],
+            'conflicts': self.conflicts,
+            'options': self.options}
+
+    def solve(self):
+        ''' Returns the tech given each shift, or None
+
+        Coverage decomposes exactly, since filled shifts and hour deviation
+        are sums over components. The typical deviation that pain is
+        measured against is the one shared quantity, so it is computed from
+        every component's result before the pain phase runs.
+        '''
+
+        components = findComponents(self.availability)
+        tasks = [self.makeTask(shifts, techs) for shifts, techs in components]
+
+        # Largest components first so the pool finishes evenly
+        order = sorted(range(len(tasks)), key=lambda i: -len(tasks[i]['hours']))
+
+        with futures.ProcessPoolExecutor(max_workers=self.processes) as pool:
+            results = dict(zip(order, pool.map(solveCoverage, [tasks[i] for i in order])))
+
+            # Techs with no shifts in reach are as far off as their target
+            deviation = sum(result['deviation'] for result in results.values())
+            placed = set(t for _, techs in components for t in techs)
+            deviation += sum(abs(target) for t, target in enumerate(self.targets)
+                             if t not in placed)
+            pain = deviation // max(len(self.targets), 1)
+            print('filled: {} deviation: {} ({} components)'.format(
+                sum(result['filled'] for result in results.values()),
+                deviation, len(tasks)))
+
+            for i, task in enumerate(tasks):
+                task.update(results[i], pain=pain)
+            spreads = dict(zip(order, pool.map(solveSpread, [tasks[i] for i in order])))
+
+        assignment = [None for _ in self.hours]
+        for i, (shifts, techs) in enumerate(components):
+            for phase in results[i]['phases'] + spreads[i]['phases']:
+                shopTrace.trace.recordPhase(dict(phase, component=i))
+            for s, t in zip(shifts, spreads[i]['assignment']):
+                if t is not None:
+                    assignment[s] = techs[t]
+
+        return assignment
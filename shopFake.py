@@ -0,0 +1,389 @@
+import os
+import copy
+import time
+import zlib
+import random
+import datetime
+import httplib2
+import threading
+
+from apiclient import errors
+
+# Calendars the shop schedules on
+CALENDARS = [
+    'Maintenance - Mustang 60',
+    'Maintenance - Hangar',
+    'Schedule - Rookies',
+    'Schedule - Red Tags',
+    'Schedule - Yellow Tags',
+    'Schedule - Mustang 60',
+    'Schedule - Hangar']
+
+# Roughly how a roster splits between positions
+_POSITIONS = [
+    ('Rookie Tech', 0.4),
+    ('Junior Tech', 0.3),
+    ('Senior Tech', 0.2),
+    ('Supervisor', 0.1)]
+
+# Standard shift slots as (start hour, length)
+_SLOTS = [(8, 4), (12, 4), (16, 4), (20, 3), (10, 6), (14, 2)]
+
+_DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday',
+              'Friday', 'Saturday', 'Sunday']
+
+# Injected failures, mimicking quota and server errors
+_ERROR_STATUS = [429, 500, 503]
+
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S-07:00'
+
+def _parseTime(value):
+    ''' Parses an event time or query bound, ignoring the time zone '''
+
+    if isinstance(value, dict):
+        value = value.get('dateTime', value.get('date'))
+    return datetime.datetime.fromisoformat(value[:19])
+
+def makeRoster(num_techs, rng, first_hour=7, last_hour=23, weeks=10):
+    ''' Generates the values of a roster spreadsheet, header row first '''
+
+    header = ['Timestamp', 'First Name', 'Last Name', 'Nickname',
+              'Google Email Address', 'Edit URL', 'Position', 'Hours per Week']
+    header += ['Conflicts by Week [{:02d}:00]'.format(h)
+               for h in range(first_hour, last_hour)]
+    header += ['Conflicts by Quarter [Week {}]'.format(w + 1) for w in range(weeks)]
+
+    positions = [p for p, _ in _POSITIONS]
+    weights = [w for _, w in _POSITIONS]
+
+    rows = [header]
+    for t in range(num_techs):
+
+        # Classes and other commitments block out a few runs of hours a day
+        busy = [set() for _ in range(last_hour - first_hour)]
+        for d, day in enumerate(_DAY_NAMES):
+            for _ in range(rng.randrange(0, 3)):
+                start = rng.randrange(0, len(busy))
+                for h in range(start, min(start + rng.randrange(1, 5), len(busy))):
+                    busy[h].add(day)
+
+        away = [[day for day in _DAY_NAMES if rng.random() < 0.05]
+                for _ in range(weeks)]
+
+        row = [
+            '1/1/2018 00:00:00',
+            'Tech{}'.format(t),
+            'Last{}'.format(t),
+            'Nick{}'.format(t) if rng.random() < 0.2 else '',
+            'tech{}@example.com'.format(t),
+            'https://example.com/edit/{}'.format(t),
+            rng.choices(positions, weights)[0],
+            str(rng.choice([0, 4, 8, 10, 12, 15, 20])),
+        ]
+        row += [', '.join(d for d in _DAY_NAMES if d in hour) for hour in busy]
+        row += [', '.join(days) for days in away]
+        rows.append(row)
+
+    return rows
+
+def makeEvents(num_shifts, anchor, rng, cals=CALENDARS, weeks=1):
+    ''' Generates calendar events, keyed by calendar id
+
+    anchor is the Monday the first week starts on. A few all-day events
+    are mixed in, as on the real calendars.
+    '''
+
+    calendars = {cal: [] for cal in cals}
+    for i in range(num_shifts):
+        cal = rng.choice(cals)
+        hour, length = rng.choice(_SLOTS)
+        start = anchor + datetime.timedelta(
+            days=rng.randrange(7 * weeks), hours=hour)
+        end = start + datetime.timedelta(hours=length)
+        calendars[cal].append({
+            'id': 'e{}'.format(i),
+            'etag': '"0"',
+            'summary': '',
+            'description': '',
+            'start': {'dateTime': start.strftime(_DATE_FORMAT)},
+            'end': {'dateTime': end.strftime(_DATE_FORMAT)},
+            'organizer': {'displayName': cal, 'email': cal},
+        })
+
+    for cal in cals:
+        day = anchor + datetime.timedelta(days=rng.randrange(7 * weeks))
+        calendars[cal].append({
+            'id': 'a{}'.format(cal),
+            'etag': '"0"',
+            'summary': 'Shop closed',
+            'start': {'date': day.strftime('%Y-%m-%d')},
+            'end': {'date': day.strftime('%Y-%m-%d')},
+            'organizer': {'displayName': cal, 'email': cal},
+        })
+
+    return calendars
+
+class FakeConfig(object):
+
+    def __init__(self, anchor, calendars, spreadsheet='roster'):
+        ''' Stands in for shopConfig '''
+
+        self.anchor = anchor
+        self.calendars = calendars
+        self.spreadsheet = spreadsheet
+
+class FakeRequest(object):
+
+    def __init__(self, backend, method, **kwargs):
+        ''' A call that runs against the backend when executed '''
+
+        self.backend = backend
+        self.method = method
+        self.kwargs = kwargs
+        self.headers = {}
+
+    def execute(self, http=None, num_retries=0):
+        ''' Runs the call after the configured latency '''
+
+        self.backend.wait()
+        return self.backend.call(self)
+
+class FakeBatch(object):
+
+    def __init__(self, backend, callback=None):
+        ''' Collects calls to run in one round trip '''
+
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http=None):
+        ''' Runs every call, reporting each to its callback '''
+
+        self.backend.wait()
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = self.backend.call(request), None
+            except errors.HttpError as error:
+                response, exception = None, error
+            if callback:
+                callback(request_id, response, exception)
+
+class FakeResource(object):
+
+    def __init__(self, backend, methods):
+        ''' Exposes backend calls with the Google client's call syntax '''
+
+        self.backend = backend
+        self.methods = methods
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self.methods:
+            raise AttributeError(name)
+        target = self.methods[name]
+        if callable(target):
+            return target
+        return lambda **kwargs: FakeRequest(self.backend, target, **kwargs)
+
+class FakeBackend(object):
+
+    def __init__(self, rows, calendars, latency=0.0, error_rate=0.0, seed=None):
+        ''' In-process Gmail, Sheets and Calendar
+
+        rows are the roster spreadsheet's values and calendars maps calendar
+        ids to their events. Every round trip sleeps for latency seconds and
+        each call fails with a quota or server error at error_rate.
+        '''
+
+        self.rows = rows
+        self.events = {cal: {e['id']: copy.deepcopy(e) for e in items}
+                       for cal, items in calendars.items()}
+
+        # Sync tokens count changes, and only mean something to this backend
+        self.epoch = os.urandom(4).hex()
+        self.sequence = 0
+        self.changed = {(cal, e): 0 for cal, items in self.events.items() for e in items}
+        self.cancelled = {}
+        self.sent = []
+        self.calls = {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def call(self, request):
+        ''' Dispatches a request, failing it at the configured rate '''
+
+        with self.lock:
+            self.calls[request.method] = self.calls.get(request.method, 0) + 1
+            fail = self.error_rate and self.rng.random() < self.error_rate
+            status = self.rng.choice(_ERROR_STATUS)
+            if fail:
+                raise self.error(status)
+            return getattr(self, request.method)(request, **request.kwargs)
+
+    def error(self, status):
+        return errors.HttpError(httplib2.Response({'status': status}), b'{}')
+
+    # Calendar
+
+    def listEvents(self, request, calendarId, timeMin=None, timeMax=None,
+                   pageToken=None, maxResults=250, syncToken=None, **kwargs):
+        since = -1
+        if syncToken:
+            epoch, _, sequence = syncToken.partition(':')
+            if epoch != self.epoch:
+                raise self.error(410)
+            since = int(sequence)
+
+        items = []
+        for event in self.events.get(calendarId, {}).values():
+            start = _parseTime(event['start'])
+            end = _parseTime(event['end'])
+            if timeMax and start >= _parseTime(timeMax):
+                continue
+            if timeMin and end <= _parseTime(timeMin):
+                continue
+            if self.changed[(calendarId, event['id'])] <= since:
+                continue
+            items.append(copy.deepcopy(event))
+
+        if syncToken:
+            items += [{'id': event_id, 'status': 'cancelled'}
+                      for (cal, event_id), sequence in self.cancelled.items()
+                      if cal == calendarId and sequence > since]
+
+        first = int(pageToken or 0)
+        result = {'items': items[first:first + maxResults]}
+        if first + maxResults < len(items):
+            result['nextPageToken'] = str(first + maxResults)
+        elif not timeMin and not timeMax:
+            result['nextSyncToken'] = '{}:{}'.format(self.epoch, self.sequence)
+        return result
+
+    def cancelEvent(self, calendarId, eventId):
+        ''' Deletes an event, as someone editing the calendar by hand would '''
+
+        with self.lock:
+            self.sequence += 1
+            del self.events[calendarId][eventId]
+            self.cancelled[(calendarId, eventId)] = self.sequence
+
+    def listNext(self, request, result):
+        if 'nextPageToken' not in result:
+            return None
+        kwargs = dict(request.kwargs, pageToken=result['nextPageToken'])
+        return FakeRequest(self, 'listEvents', **kwargs)
+
+    def patchEvent(self, request, calendarId, eventId, body, **kwargs):
+        event = self.events[calendarId][eventId]
+        if request.headers.get('If-Match', event['etag']) != event['etag']:
+            raise self.error(412)
+        event.update(copy.deepcopy(body))
+        event['etag'] = '"{}"'.format(int(event['etag'].strip('"')) + 1)
+        self.sequence += 1
+        self.changed[(calendarId, eventId)] = self.sequence
+        return copy.deepcopy(event)
+
+    def updateEvent(self, request, calendarId, eventId, body, **kwargs):
+        return self.patchEvent(request, calendarId, eventId, body)
+
+    # Sheets
+
+    def getSpreadsheet(self, request, spreadsheetId, **kwargs):
+        return {'sheets': [{'properties': {
+            'title': 'Form Responses 1',
+            'gridProperties': {
+                'rowCount': len(self.rows) + 100,
+                'columnCount': len(self.rows[0])}}}]}
+
+    def getValues(self, request, spreadsheetId, range, **kwargs):
+        return {'range': range, 'values': copy.deepcopy(self.rows)}
+
+    # Drive
+
+    def getFile(self, request, fileId, **kwargs):
+        # The version moves whenever the roster's contents do
+        return {'version': str(zlib.crc32(repr(self.rows).encode('utf-8')))}
+
+    # Gmail
+
+    def sendMessage(self, request, userId, body, **kwargs):
+        self.sent.append(body)
+        return {'id': str(len(self.sent)), 'labelIds': ['SENT']}
+
+    def batch(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def calendar(self):
+        events = FakeResource(self, {
+            'list': 'listEvents',
+            'patch': 'patchEvent',
+            'update': 'updateEvent',
+            'list_next': self.listNext})
+        return FakeResource(self, {
+            'events': lambda: events,
+            'new_batch_http_request': self.batch})
+
+    def sheets(self):
+        values = FakeResource(self, {'get': 'getValues'})
+        spreadsheets = FakeResource(self, {
+            'get': 'getSpreadsheet',
+            'values': lambda: values})
+        return FakeResource(self, {
+            'spreadsheets': lambda: spreadsheets,
+            'new_batch_http_request': self.batch})
+
+    def drive(self):
+        files = FakeResource(self, {'get': 'getFile'})
+        return FakeResource(self, {'files': lambda: files})
+
+    def gmail(self):
+        messages = FakeResource(self, {'send': 'sendMessage'})
+        users = FakeResource(self, {'messages': lambda: messages})
+        return FakeResource(self, {
+            'users': lambda: users,
+            'new_batch_http_request': self.batch})
+
+class FakeProvider(object):
+
+    def __init__(self, backend):
+        ''' Serves the fake backend in place of services.ServiceProvider '''
+
+        self.backend = backend
+        self._services = {
+            'gmail': backend.gmail(),
+            'sheets': backend.sheets(),
+            'drive': backend.drive(),
+            'calendar': backend.calendar()}
+
+    def get_service(self, service_name):
+        return self._services[service_name]
+
+    def get_http(self):
+        return None
+
+def makeShop(num_techs, num_shifts, week=1, weeks=1, anchor='2018-01-01', seed=0, **kwargs):
+    ''' Generates a synthetic shop, returning its provider and config
+
+    Shifts fill the given weeks of the quarter from week on, num_shifts a
+    week; kwargs go to FakeBackend.
+    '''
+
+    rng = random.Random(seed)
+    start = datetime.datetime.strptime(anchor, '%Y-%m-%d')
+    start += datetime.timedelta(days=7 * week)
+    rows = makeRoster(num_techs, rng)
+    calendars = makeEvents(num_shifts * weeks, start, rng, weeks=weeks)
+
+    backend = FakeBackend(rows, calendars, seed=seed, **kwargs)
+    config = FakeConfig(anchor, list(calendars))
+    return FakeProvider(backend), config
@@ -0,0 +1,192 @@
+import numpy as np
+
+def findBlocks(conflicts):
+    ''' Splits shifts into runs that no same-day conflict crosses
+
+    Shifts are sorted by start, so a run ends where no earlier shift
+    reaches past it. Returns (first, last) index ranges covering every
+    shift.
+    '''
+
+    blocks = []
+    first = 0
+    reach = 0
+    for s, last in enumerate(conflicts):
+        if s >= reach and s > first:
+            blocks.append((first, s))
+            first = s
+        reach = max(reach, last)
+    if conflicts:
+        blocks.append((first, len(conflicts)))
+
+    return blocks
+
+class ShopHeuristic(object):
+
+    def __init__(self, targets, hours, availability, conflicts, limits=None, weeks=None,
+                 worked=None):
+        ''' Schedules a week quickly, without CP-SAT
+
+        Arguments match ShopModel, except conflicts is the list from
+        parseConflicts. Each run of same-day shifts is filled by bipartite
+        matching, techs furthest below their target tried first, and hours
+        are then evened out by moving and swapping shifts. The result is
+        good, not optimal, and takes milliseconds.
+        '''
+
+        self.targets = targets
+        self.hours = hours
+        self.availability = np.asarray(availability, dtype=bool).reshape(len(hours), len(targets))
+        self.weeks = weeks if weeks is not None else [0 for _ in hours]
+        num_weeks = len(limits[0]) if limits else max(self.weeks, default=0) + 1
+        self.limits = limits or [[20] * num_weeks for _ in targets]
+
+        # Techs with no target are kept off the schedule, as in ShopModel
+        self.candidates = [[int(t) for t in np.nonzero(row)[0] if targets[t]]
+                           for row in self.availability]
+        self.allowed = [set(candidates) for candidates in self.candidates]
+        self.blocks = findBlocks(conflicts)
+        self.block = [0 for _ in hours]
+        for b, (first, last) in enumerate(self.blocks):
+            for s in range(first, last):
+                self.block[s] = b
+
+        self.assignment = [None for _ in hours]
+        self.worked = list(worked) if worked else [0 for _ in targets]
+        self.weekly = [[0] * num_weeks for _ in targets]
+        self.held = [{} for _ in self.blocks]   # Tech to the shift they work, per block
+
+    def solve(self):
+        ''' Returns the tech given each shift, or None '''
+
+        for b in range(len(self.blocks)):
+            self.matchBlock(b)
+        self.balance()
+
+        return list(self.assignment)
+
+    def need(self, t):
+        return self.targets[t] - self.worked[t]
+
+    def fits(self, t, s, freed=0):
+        ''' Whether tech t has room in the week of shift s, after giving up freed hours '''
+
+        w = self.weeks[s]
+        return self.weekly[t][w] - freed + self.hours[s] <= self.limits[t][w]
+
+    def matchBlock(self, b):
+        ''' Fills as many of a block's shifts as possible, one per tech '''
+
+        first, last = self.blocks[b]
+        owner = {}
+
+        # Needs only change once the block is matched, so order once
+        need = {t: self.need(t) for s in range(first, last) for t in self.candidates[s]}
+        order = {s: sorted((t for t in self.candidates[s] if self.fits(t, s)), key=lambda t: -need[t])
+                 for s in range(first, last)}
+
+        def augment(s, seen):
+            for t in order[s]:
+                if t in seen:
+                    continue
+                seen.add(t)
+                if t not in owner or augment(owner[t], seen):
+                    owner[t] = s
+                    return True
+            return False
+
+        # The hardest shifts to fill go first
+        for s in sorted(range(first, last), key=lambda s: len(self.candidates[s])):
+            augment(s, set())
+
+        for t, s in owner.items():
+            self.give(s, t)
+
+    def give(self, s, t):
+        ''' Hands shift s to tech t, taking it from whoever had it '''
+
+        previous = self.assignment[s]
+        if previous is not None:
+            self.worked[previous] -= self.hours[s]
+            self.weekly[previous][self.weeks[s]] -= self.hours[s]
+            del self.held[self.block[s]][previous]
+
+        self.assignment[s] = t
+        if t is not None:
+            self.worked[t] += self.hours[s]
+            self.weekly[t][self.weeks[s]] += self.hours[s]
+            self.held[self.block[s]][t] = s
+
+    def balance(self):
+        ''' Moves and swaps shifts while that fills one or evens out hours
+
+        Every change fills a shift or lowers the total deviation, so the
+        search ends.
+        '''
+
+        cost = lambda t, change: abs(self.need(t) - change) - abs(self.need(t))
+        shifts_of = lambda t: [held[t] for held in self.held if t in held]
+
+        # Hours only even out between a tech above target and one below
+        below = lambda a, b: self.need(a) * self.need(b) < 0
+
+        improved = True
+        while improved:
+            improved = False
+            for s, a in enumerate(self.assignment):
+                h = self.hours[s]
+                held = self.held[self.block[s]]
+                free = [t for t in self.candidates[s]
+                        if t != a and t not in held and self.fits(t, s)]
+
+                # An open shift goes to whoever is furthest below target
+                if a is None:
+                    if free:
+                        self.give(s, max(free, key=self.need))
+                        improved = True
+                    continue
+
+                if self.need(a) == 0:
+                    continue
+
+                # Moving the shift to someone idle that day
+                moves = [(cost(a, -h) + cost(b, h), b) for b in free if below(a, b)]
+                if moves and min(moves)[0] < 0:
+                    self.give(s, min(moves)[1])
+                    improved = True
+                    continue
+
+                # Trading it for one of their shifts
+                for b in self.candidates[s]:
+                    if b == a or not below(a, b):
+                        continue
+                    for s2 in shifts_of(b):
+                        if self.trade(s, a, s2, b):
+                            improved = True
+                            break
+                    else:
+                        continue
+                    break
+
+    def trade(self, s, a, s2, b):
+        ''' Swaps shift s held by a with s2 held by b when that lowers deviation '''
+
+        h, h2 = self.hours[s], self.hours[s2]
+        if h == h2 or a not in self.allowed[s2]:
+            return False
+        if abs(self.need(a) + h - h2) + abs(self.need(b) + h2 - h) >= \
+                abs(self.need(a)) + abs(self.need(b)):
+            return False
+
+        # Each must be free on the other's day, unless it is the same day
+        if self.block[s] != self.block[s2]:
+            if b in self.held[self.block[s]] or a in self.held[self.block[s2]]:
+                return False
+        same_week = self.weeks[s] == self.weeks[s2]
+        if not self.fits(a, s2, h if same_week else 0) or not self.fits(b, s, h2 if same_week else 0):
+            return False
+
+        self.give(s, None)
+        self.give(s2, a)
+        self.give(s, b)
+        return True
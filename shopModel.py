@@ -0,0 +1,446 @@
+import shopShift
+
+import bisect
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+# Hours in the weekly conflict grid
+_WEEK_HOURS = 7 * 24
+
+# Calendars each position may be scheduled on
+_PERMITTED = {
+    'Rookie Tech': [
+        'Maintenance - Mustang 60',
+        'Maintenance - Hangar',
+        'Schedule - Rookies'],
+    'Junior Tech': [
+        'Schedule - Red Tags',
+        'Schedule - Yellow Tags',
+        'Schedule - Mustang 60',
+        'Schedule - Hangar',
+        'Maintenance - Mustang 60',
+        'Maintenance - Hangar'],
+    'Senior Tech': [
+        'Schedule - Red Tags',
+        'Schedule - Yellow Tags',
+        'Schedule - Mustang 60',
+        'Schedule - Hangar',
+        'Maintenance - Mustang 60',
+        'Maintenance - Hangar'],
+    'Supervisor': [
+        'Schedule - Red Tags',
+        'Schedule - Yellow Tags',
+        'Schedule - Mustang 60',
+        'Schedule - Hangar']
+}
+
+# Maintenance supervisors work in their own shop
+_EXCLUDED = [('Fedor', 'Mustang'), ('Schmidt', 'Hangar')]
+
+class ShopModel(object):
+
+    def __init__(self, targets, hours, availability, windows, limits=None, weeks=None,
+                 worked=None):
+        ''' Builds the CP-SAT model for a set of shifts and techs
+
+        targets[t] is the number of hours tech t should work, hours[s] the
+        length of shift s and availability[s][t] whether tech t may be given
+        shift s. windows lists (first, last) shift ranges in which a tech may
+        work at most one shift, as returned by parseWindows.
+
+        weeks[s] is the week of shift s when the model spans several; the
+        targets then cover every week, and limits[t][w] caps the hours tech
+        t works in week w (20 by default) and sets how many weeks there are.
+
+        worked[t] is hours tech t already works outside the model, counted
+        towards their target.
+        '''
+
+        weeks = weeks if weeks is not None else [0 for _ in hours]
+        num_weeks = len(limits[0]) if limits else max(weeks, default=0) + 1
+        limits = limits or [[20] * num_weeks for _ in targets]
+        worked = worked or [0 for _ in targets]
+        span = 20 * num_weeks
+
+        model = cp_model.CpModel()
+        all_vars = []
+        tech_vars = [{} for _ in targets]    # Shift index to variable, per tech
+        shift_vars = [{} for _ in hours]     # Tech index to variable, per shift
+        abs_vars = []
+
+        # Only pairs that can happen get a variable
+        eligible = np.asarray(availability, dtype=bool).reshape(len(hours), len(targets))
+        for t, s in zip(*np.nonzero(eligible.T)):
+            t, s = int(t), int(s)
+            var = model.NewBoolVar('v[%i,%i]' % (t, s))
+            all_vars.append(var)
+            tech_vars[t][s] = var
+            shift_vars[s][t] = var
+
+        for t, target in enumerate(targets):
+            shifts = sorted(tech_vars[t])
+            terms = [tech_vars[t][s] for s in shifts]
+            lengths = [hours[s] for s in shifts]
+
+            # Each week is capped on its own; the target spans them all
+            for w in range(num_weeks):
+                week = [i for i, s in enumerate(shifts) if weeks[s] == w]
+                if week:
+                    model.AddLinearConstraint(cp_model.LinearExpr.WeightedSum(
+                        [terms[i] for i in week], [lengths[i] for i in week]), 0, limits[t][w])
+
+            tech_worked = cp_model.LinearExpr.WeightedSum(terms, lengths)
+            hour_var = model.NewIntVar(-span, span, 'h[%i]' % t)
+            model.Add(hour_var + tech_worked + worked[t] == target)
+            if target == 0:
+                model.Add(hour_var == 0)
+
+            abs_var = model.NewIntVar(0, span, 'a[%i]' % t)
+            abs_vars.append(abs_var)
+            model.AddAbsEquality(abs_var, hour_var)
+
+            # One constraint per maximal window the tech can work twice in
+            for first, last in windows:
+                i = bisect.bisect_left(shifts, first)
+                j = bisect.bisect_left(shifts, last)
+                if j - i > 1:
+                    model.AddAtMostOne(terms[i:j])
+
+        for s in range(len(hours)):
+            if len(shift_vars[s]) > 1:
+                model.AddAtMostOne(list(shift_vars[s].values()))
+
+        self.model = model
+        self.all_vars = all_vars
+        self.tech_vars = tech_vars
+        self.shift_vars = shift_vars
+        self.abs_vars = abs_vars
+        self.abs_abs_vars = []
+        self.span = span
+
+        self.filled = cp_model.LinearExpr.Sum(all_vars)
+        self.deviation = cp_model.LinearExpr.Sum(abs_vars)
+
+    def assignment(self, solver):
+        ''' Returns the tech given each shift in a solution, or None '''
+
+        assignment = [None for _ in self.shift_vars]
+        for s, shift_vars in enumerate(self.shift_vars):
+            for t, var in shift_vars.items():
+                if solver.BooleanValue(var):
+                    assignment[s] = t
+
+        return assignment
+
+    def hintAssignment(self, assignment):
+        ''' Suggests a known schedule as the solver's starting point '''
+
+        for s, shift_vars in enumerate(self.shift_vars):
+            for t, var in shift_vars.items():
+                self.model.AddHint(var, assignment[s] == t)
+
+    def addPain(self, pain):
+        ''' Measures how far each tech's deviation is from the typical one
+
+        pain is either a constant or a model variable holding the average
+        deviation across techs.
+        '''
+
+        model = self.model
+        for t, abs_var in enumerate(self.abs_vars):
+            pain_var = model.NewIntVar(-self.span, self.span, 'p[%i]' % t)
+            abs_abs_var = model.NewIntVar(0, self.span, 'aa[%i]' % t)
+            self.abs_abs_vars.append(abs_abs_var)
+            model.Add(pain_var == pain - abs_var)
+            model.AddAbsEquality(abs_abs_var, pain_var)
+
+        return self.abs_abs_vars
+
+    @staticmethod
+    def parseConflicts(shifts):
+        ''' Determine which shifts overlap with one another '''
+
+        start, end = shopShift.gatherTimes(shifts)
+        order = np.argsort(start, kind='stable')
+        shifts[:] = [shifts[s] for s in order]
+        start, end = start[order], end[order]
+
+        # Shifts that actually overlap
+        overlaps = list(enumerate(np.searchsorted(start, end).tolist()))
+
+        # Shifts that are on the same day
+        next_day = end.astype('datetime64[D]') + np.timedelta64(1, 'D')
+        conflicts = np.searchsorted(start, next_day.astype('datetime64[s]')).tolist()
+
+        return overlaps, conflicts
+
+    @staticmethod
+    def parseAvailability(shifts, techs):
+        ''' Determines which shifts each tech can work
+
+        Returns a shifts x techs boolean array. Eligibility comes from a
+        calendar x position table, and conflicts from multiplying each
+        shift's hours of the week against each tech's weekly conflict grid.
+        '''
+
+        hour = np.timedelta64(1, 'h')
+        levels = {level: l for l, level in enumerate(_PERMITTED)}
+        shift_names = [shift.cal for shift in shifts]
+        cals = sorted(set(shift_names))
+
+        # Positions not in the table cannot work any calendar
+        table = np.zeros((len(cals), len(levels) + 1), dtype=bool)
+        for c, cal in enumerate(cals):
+            for level, l in levels.items():
+                table[c, l] = cal in _PERMITTED[level]
+
+        cal_index = {cal: c for c, cal in enumerate(cals)}
+        shift_cals = np.array([cal_index[cal] for cal in shift_names], dtype=np.intp)
+        tech_levels = np.array([levels.get(tech.level, len(levels)) for tech in techs], dtype=np.intp)
+        available = table[shift_cals][:, tech_levels]
+
+        for last, shop in _EXCLUDED:
+            rows = np.array([shop in cal for cal in cals], dtype=bool)[shift_cals]
+            cols = np.array([tech.last == last for tech in techs], dtype=bool)
+            available &= ~(rows[:, None] & cols[None, :])
+
+        # Hours of the week each shift touches, wrapping past Sunday night;
+        # the epoch fell on a Thursday
+        start, end = shopShift.gatherTimes(shifts)
+        days = start.astype('datetime64[D]')
+        weekdays = (days.astype(np.int64) + 3) % 7
+        firsts = (weekdays * 24 + (start - days) // hour).astype(np.intp)
+        lengths = (-((start.astype('datetime64[h]') - end) // hour)).astype(np.intp)
+        week = np.arange(2 * _WEEK_HOURS)
+        touched = (week >= firsts[:, None]) & (week < (firsts + lengths)[:, None])
+        touched = touched[:, :_WEEK_HOURS] | touched[:, _WEEK_HOURS:]
+
+        busy = np.array([tech.by_hour for tech in techs], dtype=bool).reshape(len(techs), _WEEK_HOURS)
+        clashes = touched.astype(np.float32) @ busy.T.astype(np.float32)
+
+        return available & (clashes == 0)
+
+    @staticmethod
+    def parseClasses(targets, availability, limits=None):
+        ''' Groups techs who can stand in for one another
+
+        Techs are interchangeable when they can work exactly the same
+        shifts and have the same target and limits. Returns every group,
+        a lone tech being a group of one, in order of their first tech.
+        '''
+
+        columns = np.asarray(availability, dtype=bool).reshape(-1, len(targets)).T
+        groups = {}
+        for t, target in enumerate(targets):
+            key = (target, tuple(limits[t]) if limits else None, columns[t].tobytes())
+            groups.setdefault(key, []).append(t)
+
+        return sorted(groups.values())
+
+    @staticmethod
+    def repairModel(targets, hours, kept, freed, availability, conflicts):
+        ''' Builds a model over the freed shifts of a schedule alone
+
+        kept[s] is the tech keeping shift s, or None, and availability
+        should already be blocked around kept shifts (see blockKept).
+        Kept hours count towards each tech's target, and limits are what
+        each tech has left after the shifts they keep.
+        '''
+
+        worked = [0 for _ in targets]
+        for s, t in enumerate(kept):
+            if t is not None:
+                worked[t] += hours[s]
+
+        return ShopModel(
+            targets,
+            [hours[s] for s in freed],
+            availability[freed],
+            ShopModel.parseWindows(ShopModel.restrictConflicts(conflicts, freed)),
+            limits=[[max(20 - hours, 0)] for hours in worked],
+            worked=worked)
+
+    @staticmethod
+    def parseRepair(held, availability, conflicts):
+        ''' Chooses the shifts of a schedule to reassign after a change
+
+        held[s] is the tech holding shift s, or None. A shift is freed when
+        its holder can no longer work it or already works another shift
+        that day. When nobody free that day can take an open shift, the
+        same-day shifts of techs who could are freed too, so a repair can
+        swap them around. Returns the freed shifts.
+        '''
+
+        freed = np.array([t is None for t in held], dtype=bool)
+
+        reach = {}
+        for s, t in enumerate(held):
+            if t is None:
+                continue
+            if not availability[s][t] or reach.get(t, 0) > s:
+                freed[s] = True
+            else:
+                reach[t] = conflicts[s]
+
+        # One ring of swaps around the open shifts nobody idle can take
+        ring = freed.copy()
+        for first, last in ShopModel.parseWindows(conflicts):
+            working = set(held[c] for c in range(first, last) if not freed[c])
+            for s in range(first, last):
+                if not freed[s]:
+                    continue
+                idle = [t for t in np.nonzero(availability[s])[0] if t not in working]
+                if idle:
+                    continue
+                for c in range(first, last):
+                    if held[c] is not None and availability[s][held[c]]:
+                        ring[c] = True
+
+        return [s for s in range(len(held)) if ring[s]]
+
+    @staticmethod
+    def blockKept(availability, conflicts, kept):
+        ''' Keeps techs off the other shifts on days they already work
+
+        kept[s] is the tech holding shift s, or None.
+        '''
+
+        for s, t in enumerate(kept):
+            for c in range(s, conflicts[s]):
+                if kept[c] is not None:
+                    availability[s][kept[c]] = False
+                if t is not None:
+                    availability[c][t] = False
+
+    @staticmethod
+    def restrictConflicts(conflicts, subset):
+        ''' Re-indexes the same-day conflicts within a sorted subset of shifts '''
+
+        return [bisect.bisect_left(subset, conflicts[s]) for s in subset]
+
+    @staticmethod
+    def parseWindows(conflicts):
+        ''' Reduces the same-day windows to those not contained in another
+
+        Shift s may not be worked alongside shifts s+1 .. conflicts[s]-1. With
+        shifts sorted by start, the window of s is redundant whenever an
+        earlier shift's window reaches at least as far, so a single pass
+        keeps only the maximal windows.
+        '''
+
+        windows = []
+        reach = 0
+        for first, last in enumerate(conflicts):
+            if last <= reach:
+                continue
+            reach = last
+            if last - first > 1:
+                windows.append((first, last))
+
+        return windows
+
+class ClassModel(ShopModel):
+
+    def __init__(self, classes, targets, hours, availability, windows, limits=None, weeks=None):
+        ''' Builds a ShopModel over classes of interchangeable techs
+
+        classes are the groups from parseClasses; other arguments are as
+        for ShopModel. Each class takes shifts as one, counting out how many
+        of its shifts of each length every tech works each week. Counts
+        ignore which day a shift falls on, so the optimum of each objective
+        is a bound on that of the full model, and the two agree whenever
+        the class's shifts can be dealt out to match.
+        '''
+
+        weeks = weeks if weeks is not None else [0 for _ in hours]
+        num_weeks = len(limits[0]) if limits else max(weeks, default=0) + 1
+        limits = limits or [[20] * num_weeks for _ in targets]
+        span = 20 * num_weeks
+
+        model = cp_model.CpModel()
+        all_vars = []
+        class_vars = [{} for _ in classes]   # Shift index to variable, per class
+        shift_vars = [{} for _ in hours]     # Class index to variable, per shift
+        split_vars = [[] for _ in classes]   # Weekly hours of each tech, per class
+        abs_vars = []
+
+        eligible = np.asarray(availability, dtype=bool).reshape(len(hours), len(targets))
+        for c, members in enumerate(classes):
+            for s in np.nonzero(eligible[:, members[0]])[0]:
+                s = int(s)
+                var = model.NewBoolVar('y[%i,%i]' % (c, s))
+                all_vars.append(var)
+                class_vars[c][s] = var
+                shift_vars[s][c] = var
+
+        for c, members in enumerate(classes):
+            shifts = sorted(class_vars[c])
+            terms = [class_vars[c][s] for s in shifts]
+            lengths = [hours[s] for s in shifts]
+
+            # Techs take whole shifts, so the class's shifts of each length
+            # are counted out between them
+            split_vars[c] = [[] for _ in members]
+            for w in range(num_weeks):
+                week = [i for i, s in enumerate(shifts) if weeks[s] == w]
+                if len(members) == 1:
+                    weekly = cp_model.LinearExpr.WeightedSum(
+                        [terms[i] for i in week], [lengths[i] for i in week])
+                    model.AddLinearConstraint(weekly, 0, limits[members[0]][w])
+                    split_vars[c][0].append(weekly)
+                    continue
+
+                counts = [[] for _ in members]
+                for length in sorted(set(lengths[i] for i in week)):
+                    taken = [terms[i] for i in week if lengths[i] == length]
+                    shares = [model.NewIntVar(0, len(taken), 'n[%i,%i,%i]' % (t, w, length))
+                              for t in members]
+                    model.Add(cp_model.LinearExpr.Sum(shares) == cp_model.LinearExpr.Sum(taken))
+                    for m, share in enumerate(shares):
+                        counts[m].append((share, length))
+
+                for m, t in enumerate(members):
+                    weekly = cp_model.LinearExpr.WeightedSum(
+                        [share for share, _ in counts[m]], [length for _, length in counts[m]])
+                    model.AddLinearConstraint(weekly, 0, limits[t][w])
+                    split_vars[c][m].append(weekly)
+
+            # Techs in a class are alike, so the busiest comes first
+            worked = [cp_model.LinearExpr.Sum(split) for split in split_vars[c]]
+            for first, second in zip(worked, worked[1:]):
+                model.Add(first >= second)
+
+            for t, tech_worked in zip(members, worked):
+                hour_var = model.NewIntVar(-span, span, 'h[%i]' % t)
+                model.Add(hour_var + tech_worked == targets[t])
+                if targets[t] == 0:
+                    model.Add(hour_var == 0)
+
+                abs_var = model.NewIntVar(0, span, 'a[%i]' % t)
+                abs_vars.append(abs_var)
+                model.AddAbsEquality(abs_var, hour_var)
+
+            # A class works as many shifts in a window as it has techs
+            for first, last in windows:
+                i = bisect.bisect_left(shifts, first)
+                j = bisect.bisect_left(shifts, last)
+                if j - i > len(members):
+                    model.AddLinearConstraint(cp_model.LinearExpr.Sum(terms[i:j]), 0, len(members))
+
+        for s in range(len(hours)):
+            if len(shift_vars[s]) > 1:
+                model.AddAtMostOne(list(shift_vars[s].values()))
+
+        self.model = model
+        self.classes = classes
+        self.all_vars = all_vars
+        self.tech_vars = class_vars
+        self.shift_vars = shift_vars
+        self.split_vars = split_vars
+        self.abs_vars = abs_vars
+        self.abs_abs_vars = []
+        self.span = span
+
+        self.filled = cp_model.LinearExpr.Sum(all_vars)
+        self.deviation = cp_model.LinearExpr.Sum(abs_vars)
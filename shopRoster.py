@@ -1,50 +1,121 @@
+import os
+import re
+import json
 import bisect
+import hashlib
 import datetime
-import re
-import time
+import shopBatch
 import shopTech
+import shopTrace
+import shopSnapshot
+
+from apiclient import errors
+
+# Gmail allows a few sends per second per user; bursts beyond that get 429s
+_EMAIL_RATE = 5
+_EMAIL_BATCH_SIZE = 10
 
 class ShopRoster(object):
-    def __init__(self, gsheets, gmail, sheet_id, anchor):
+    def __init__(self, gsheets, gmail, sheet_id, anchor, http=None, techs=None,
+                 gdrive=None, cache=None):
+        ''' Loads the techs on the roster
+
+        Techs already loaded, as from a snapshot, are used as they are.
+        cache names a file holding the last roster fetched; it is reused
+        while gdrive reports the spreadsheet unchanged.
+        '''
 
         self.gsheets = gsheets
         self.gmail = gmail
+        self.gdrive = gdrive
+        self.sheet_id = sheet_id
+        self.cache = cache
+        self.http = http
 
         self.anchor_date = datetime.datetime.strptime(anchor, '%Y-%m-%d')
-        self.getTechs(sheet_id)
-
-    def getSize(self, sheet_id):
-        ''' Determines the size of a spreadsheet '''
-
-        request = self.gsheets.spreadsheets().get(spreadsheetId=sheet_id)
-        result = request.execute()
-
-        properties = result['sheets'][0]['properties']['gridProperties']
-        cols = properties['columnCount']
-        rows = properties['rowCount']
+        if techs is not None:
+            self.techs = techs
+            return
+        with shopTrace.trace.stage('roster:fetch'):
+            self.getTechs(sheet_id)
+
+    def getRevision(self, sheet_id):
+        ''' Returns the spreadsheet's Drive version, or None if unknown '''
+
+        if self.gdrive is None:
+            return None
+
+        http = self.http() if self.http else None
+        request = self.gdrive.files().get(fileId=sheet_id, fields='version')
+        try:
+            return shopTrace.trace.execute('drive.files.get', request, http=http)['version']
+        except errors.HttpError:
+            return None
+
+    def getTitle(self, sheet_id):
+        ''' Returns the title of the spreadsheet's first sheet '''
+
+        http = self.http() if self.http else None
+        request = self.gsheets.spreadsheets().get(
+            spreadsheetId=sheet_id, fields='sheets(properties(title))')
+        result = shopTrace.trace.execute('sheets.spreadsheets.get', request, http=http)
+        return result['sheets'][0]['properties']['title']
+
+    def getValues(self, sheet_id, title):
+        ''' Retrieves the populated cells of a sheet '''
+
+        # A bare sheet name covers just the cells in use
+        http = self.http() if self.http else None
+        request = self.gsheets.spreadsheets().values().get(
+            spreadsheetId=sheet_id, range="'{}'".format(title.replace("'", "''")))
+        result = shopTrace.trace.execute('sheets.values.get', request, http=http)
+        return result['values']
 
-        chars = []
-        while cols > 0:
-            cols, remainder = divmod(cols - 1, 26)
-            chars.insert(0, chr(65 + remainder))
+    def getTechs(self, sheet_id):
+        ''' Loads techs from a spreadsheet, or from the cache if it is current '''
+
+        cached = self.loadCache()
+        revision = self.getRevision(sheet_id)
+        if cached and revision is not None and cached['revision'] == revision:
+            self.techs = [shopTech.Tech.fromState(state) for state in cached['techs']]
+            return self.techs
+
+        # The sheet may have been renamed since its title was cached
+        title = cached['title'] if cached else self.getTitle(sheet_id)
+        try:
+            values = self.getValues(sheet_id, title)
+        except errors.HttpError as error:
+            if not cached or int(error.resp.status) != 400:
+                raise
+            title = self.getTitle(sheet_id)
+            values = self.getValues(sheet_id, title)
+
+        self.techs = self.parseTechs(values)
+        if self.cache:
+            shopSnapshot.saveState(self.cache, {
+                'revision': revision,
+                'title': title,
+                'techs': [tech.getState() for tech in self.techs]})
 
-        width = ''.join(chars)
-        height = rows
+        return self.techs
 
-        return 'A1:{}{}'.format(width, height)
+    def loadCache(self):
+        ''' Reads the cached roster, or returns None if there is none to use '''
 
-    def getTechs(self, sheet_id):
-        ''' Loads techs from a spreadsheet '''
+        if not self.cache or not os.path.exists(self.cache):
+            return None
+        try:
+            return shopSnapshot.loadState(self.cache)
+        except (OSError, ValueError):
+            return None
 
-        size = self.getSize(sheet_id)
-        request = self.gsheets.spreadsheets().values().get(
-            spreadsheetId=sheet_id, range=size)
-        result = request.execute()
+    def parseTechs(self, values):
+        ''' Creates techs from the values of the results spreadsheet '''
 
         params = {}
 
         # The first row of the results spreadsheet contains column titles
-        params['col_names'] = result['values'][0]
+        params['col_names'] = values[0]
         params['col_index'] = {n: i for i, n in enumerate(params['col_names'])}
 
         # Find columns that correspond to availability data
@@ -62,24 +133,63 @@ class ShopRoster(object):
         params['day_names'] = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 
                                'Friday', 'Saturday', 'Sunday']
 
-        techs = [shopTech.Tech(row, params) for row in result['values'][1:]]
-
-        self.techs = techs
-        return self.techs
-
-    def sendEmails(self):
-        ''' Sends emails to techs '''
-
-        requests = [tech.sendEmail(self.gmail) for tech in self.techs]
-        #batch = self.gmail.new_batch_http_request()
-
-        for r, request in enumerate(requests):
-            if request:
-                try:
-                    time.sleep(0.01)
-                    request.execute()
-                except Exception:
-                    print(self.techs[r])
-                    continue
-            #batch.add(request)
-        #batch.execute()
+        # Conflicts are parsed for the whole sheet at once; each tech views its rows
+        rows = values[1:]
+        by_hour, by_day = shopTech.Tech.parseAllConflicts(rows, params)
+        return [shopTech.Tech(row, params, conflicts=(by_hour[t], by_day[t]))
+                for t, row in enumerate(rows)]
+
+    def composeEmails(self):
+        ''' Builds every tech's message, in roster order '''
+
+        return [tech.composeEmail() for tech in self.techs]
+
+    def sendEmails(self, outbox=None, messages=None):
+        ''' Sends emails to techs, reporting on each one
+
+        outbox names a JSON file recording the emails already delivered; a
+        tech is only emailed again if their message has changed since.
+        messages are those from composeEmails, if already built.
+        '''
+
+        sent = {}
+        if outbox and os.path.exists(outbox):
+            with open(outbox) as f:
+                sent = json.load(f)
+
+        requests = []
+        digests = {}
+        for tech, message in zip(self.techs, messages or self.composeEmails()):
+            digest = hashlib.sha1(message['raw'].encode('utf-8')).hexdigest()
+            if sent.get(tech.email) == digest:
+                continue
+            digests[tech] = digest
+            requests.append((tech, tech.sendEmail(self.gmail, message)))
+
+        def done(tech, result):
+            if not result['ok']:
+                print('Not emailed: {} ({})'.format(tech.email, result['error']))
+                return
+            sent[tech.email] = digests[tech]
+            if outbox:
+                self.saveOutbox(outbox, sent)
+
+        writer = shopBatch.BatchWriter(
+            self.gmail,
+            http=self.http,
+            batch_size=_EMAIL_BATCH_SIZE,
+            rate=_EMAIL_RATE,
+            name='gmail.messages.send')
+        with shopTrace.trace.stage('roster:email'):
+            return writer.execute(requests, done=done)
+
+    def saveOutbox(self, outbox, sent):
+        ''' Records delivered emails without leaving a half-written file '''
+
+        directory = os.path.dirname(outbox)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with open(outbox + '.tmp', 'w') as f:
+            json.dump(sent, f, indent=2, sort_keys=True)
+        os.replace(outbox + '.tmp', outbox)
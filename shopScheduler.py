@@ -1,250 +1,635 @@
 import services
+import shopModel
 import shopRoster
+import shopSolver
+import shopDecompose
+import shopHeuristic
 import shopCalendar
-import shopConfig
+import shopSnapshot
+import shopShift
+import shopTrace
 
-import bisect
+import os
+import sys
+import cProfile
 import argparse
-import datetime
 
-from ortools.sat.python import cp_model
+from concurrent import futures
+
+import numpy as np
 
 class ShopScheduler():
-    def __init__(self, args):
+    def __init__(self, args, provider=None, config=None):
+        ''' Loads the roster and the week's shifts
+
+        provider and config default to the live Google services and
+        shopConfig; shopFake supplies offline stand-ins for both. With
+        --from-snapshot nothing is fetched and no services are built.
+        '''
         
         self.args = args
 
-        provider = services.ServiceProvider(
-            services.GMAIL, 
-            services.CALENDAR, 
-            services.SHEETS)
-
-        self.gmail = provider.get_service('gmail')
-        self.gsheets = provider.get_service('sheets')
-        self.gcalendar = provider.get_service('calendar')
+        snapshot = None
+        if args.from_snapshot:
+            with shopTrace.trace.stage('snapshot:load'):
+                snapshot = shopSnapshot.loadSnapshot(args.from_snapshot)
+            if (snapshot.week, snapshot.weeks) != (args.week, args.weeks):
+                raise ValueError('Snapshot covers {} week(s) from week {}, not {} from week {}'.format(
+                    snapshot.weeks, snapshot.week, args.weeks, args.week))
+            config = snapshot
+        elif config is None:
+            import shopConfig as config
+
+        with shopTrace.trace.stage('connect'):
+            if provider is None and snapshot is None:
+                provider = services.ServiceProvider(
+                    services.GMAIL, 
+                    services.CALENDAR, 
+                    services.SHEETS,
+                    services.DRIVE)
+
+            # Gmail is only built once there is something to send
+            self.provider = provider
+            self.gsheets = provider.get_service('sheets') if provider else None
+            self.gcalendar = provider.get_service('calendar') if provider else None
+            self.gdrive = provider.get_service('drive') if provider else None
+
+        self.anchor = config.anchor
+        http = provider.get_http if provider else None
+
+        # Solutions are printed as they are found, or written as JSON lines
+        self.progress = None
+        self.progress_file = None
+        if args.progress == '-':
+            self.progress = shopSolver.printProgress
+        elif args.progress:
+            self.progress_file = open(args.progress, 'w')
+            self.progress = shopSolver.streamProgress(self.progress_file)
+
+        # The roster is fetched alongside the calendars, and each calendar's
+        # availability worked out as it arrives
+        self.arrived = {}
+        with futures.ThreadPoolExecutor(max_workers=1) as pool:
+            roster = pool.submit(
+                shopRoster.ShopRoster,
+                self.gsheets, 
+                None, 
+                config.spreadsheet,
+                self.anchor,
+                http=http,
+                techs=snapshot.techs if snapshot else None,
+                gdrive=self.gdrive,
+                cache=None if args.no_cache else os.path.join(
+                    'cache', 'roster-{}.json.gz'.format(config.spreadsheet)))
+
+            def arrived(cal_id, shifts):
+                self.arrived[cal_id] = shopModel.ShopModel.parseAvailability(
+                    shifts, roster.result().techs)
+
+            self.calendar = shopCalendar.ShopCalendar(
+                self.gcalendar, 
+                config.calendars, 
+                self.anchor, 
+                self.args.week,
+                http=http,
+                weeks=self.args.weeks,
+                shifts=snapshot.shifts if snapshot else None,
+                sync=os.path.join('cache', 'calendars.json.gz') if args.sync else None,
+                arrived=arrived)
+
+            self.roster = roster.result()
+
+        # Targets come from each week's conflicts, so the weeks must be on the roster
+        quarter = len(self.roster.techs[0].by_day) if self.roster.techs else 0
+        if args.week < 1 or args.week - 1 + args.weeks > quarter:
+            raise ValueError('Weeks {}-{} are not on the roster, which covers weeks 1-{}'.format(
+                args.week, args.week - 1 + args.weeks, quarter))
+        
+    def prepare(self):
+        ''' Works out who can take each of the week's open shifts
 
-        self.anchor = shopConfig.anchor
+        When several weeks are scheduled together, each tech's target is
+        the sum of their hours over those weeks.
+        '''
 
-        self.calendar = shopCalendar.ShopCalendar(
-            self.gcalendar, 
-            shopConfig.calendars, 
-            self.anchor, 
-            self.args.week)
+        techs = self.roster.techs
+        shifts = self.calendar.shifts
 
-        self.roster = shopRoster.ShopRoster(
-            self.gsheets, 
-            self.gmail, 
-            shopConfig.spreadsheet,
-            self.anchor)
+        weeks = range(self.args.week - 1, self.args.week - 1 + self.args.weeks)
+        week_targets = [[int((tech.hours * (7 - sum(tech.by_day[w]))) // 7) for w in weeks]
+                        for tech in techs]
+        for tech, targets in zip(techs, week_targets):
+            tech.hours = sum(targets)
         
-    def parseAvailability(self, shifts, techs):
-        ''' Determines which shifts each tech can work '''
-
-        def canWork(tech, shift):
-            ''' Determines which shifts a tech can work '''
-
-            permitted = {
-                'Rookie Tech': [
-                    'Maintenance - Mustang 60', 
-                    'Maintenance - Hangar', 
-                    'Schedule - Rookies'],
-                'Junior Tech': [
-                    'Schedule - Red Tags', 
-                    'Schedule - Yellow Tags', 
-                    'Schedule - Mustang 60', 
-                    'Schedule - Hangar', 
-                    'Maintenance - Mustang 60', 
-                    'Maintenance - Hangar'],
-                'Senior Tech': [
-                    'Schedule - Red Tags', 
-                    'Schedule - Yellow Tags', 
-                    'Schedule - Mustang 60', 
-                    'Schedule - Hangar', 
-                    'Maintenance - Mustang 60', 
-                    'Maintenance - Hangar'],
-                'Supervisor': [
-                    'Schedule - Red Tags', 
-                    'Schedule - Yellow Tags', 
-                    'Schedule - Mustang 60', 
-                    'Schedule - Hangar']
-            }
-
-            if shift.cal not in permitted[tech.level]:
-                return False
-            
-            # Maintenance supervisors work in their own shop
-            if tech.last == 'Fedor' and 'Mustang' in shift.cal:
-                return False
-            
-            if tech.last == 'Schmidt' and 'Hangar' in shift.cal:
-                return False
-            
-            start = shift.start.hour
-            end = shift.end - datetime.timedelta(microseconds=1)
-            end = end.replace(minute=0, second=0, microsecond=0)
-            end = (end + datetime.timedelta(hours=1)).hour
-
-            for h in range(start, end):
-                if tech.by_hour[shift.start.weekday()][h]:
-                    return False
-
-            return True
-
-        return [[canWork(tech, shift) for tech in techs] for shift in shifts]
-
-    def parseConflicts(self, shifts):
-        ''' Determine which shifts overlap with one another '''
+        availability = self.arrivedAvailability()
+        if availability is not None:
+            order = np.argsort(shopShift.gatherTimes(shifts)[0], kind='stable')
+            availability = availability[order]
+        overlaps, conflicts = shopModel.ShopModel.parseConflicts(shifts)
+        if availability is None:
+            availability = shopModel.ShopModel.parseAvailability(shifts, techs)
+
+        self.blockAssigned(availability, conflicts)
+
+        current = [not shift.old for shift in shifts]
+        shifts[:] = [shift for shift in shifts if not shift.old]
+        availability = availability[current]
     
-        roundDay = lambda dt: dt.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
-        
-        shifts.sort(key=lambda shift: shift.start)     
-        starts = [shift.start for shift in shifts]
+        overlaps, conflicts = shopModel.ShopModel.parseConflicts(shifts)
 
-        # Shifts that actually overlap
-        overlaps = [bisect.bisect_left(starts, shift.end) for shift in shifts]
-        overlaps = [(cur, max_ov) for cur, max_ov in enumerate(overlaps)]
+        return availability, conflicts
 
-        # Shifts that are on the same day
-        conflicts = [bisect.bisect_left(starts, roundDay(shift.end)) for shift in shifts]
-       
-        return overlaps, conflicts
+    def arrivedAvailability(self):
+        ''' Returns the availability worked out as the calendars arrived
 
-    def schedule(self):
+        Rows follow the shifts as fetched, before they are sorted. Returns
+        None when the shifts did not all come from a fetch, as from a
+        snapshot, or have been fetched since; it is only used once.
+        '''
+
+        arrived, self.arrived = self.arrived, {}
+        cal_ids = self.calendar.cal_ids
+        if not cal_ids or set(arrived) != set(cal_ids):
+            return None
+
+        availability = np.concatenate([arrived[cal_id] for cal_id in cal_ids])
+        if len(availability) != len(self.calendar.shifts):
+            return None
+        return availability
+
+    def blockAssigned(self, availability, conflicts):
+        ''' Keeps techs off the other shifts on days they already work '''
+
+        shopModel.ShopModel.blockKept(
+            availability, conflicts, [shift.tech for shift in self.calendar.shifts])
+
+    def openShifts(self, availability):
+        ''' Narrows availability to the shifts nobody holds yet '''
+
+        # Shifts that are already assigned are not up for grabs
+        shifts = self.calendar.shifts
+        unassigned = np.array([shift.tech is None for shift in shifts], dtype=bool)
+        return availability & unassigned[:, None]
+
+    def buildModel(self, availability, conflicts):
+        ''' Builds the CP-SAT model over the shifts still open '''
+
+        return shopModel.ShopModel(
+            [tech.hours for tech in self.roster.techs],
+            [shift.hours for shift in self.calendar.shifts],
+            self.openShifts(availability),
+            shopModel.ShopModel.parseWindows(conflicts),
+            weeks=self.shiftWeeks())
+
+    def shiftWeeks(self):
+        ''' Returns the week of each shift, counting from the first scheduled '''
+
+        return [self.calendar.getWeekIndex(shift) for shift in self.calendar.shifts]
+
+    def solveQuick(self, availability, conflicts):
+        ''' Schedules the open shifts with the heuristic instead of CP-SAT '''
+
+        heuristic = shopHeuristic.ShopHeuristic(
+            [tech.hours for tech in self.roster.techs],
+            [shift.hours for shift in self.calendar.shifts],
+            self.openShifts(availability),
+            conflicts,
+            weeks=self.shiftWeeks())
+
+        return heuristic.solve()
+
+    def scoreSchedule(self, assignment):
+        ''' Returns the shifts filled and the total hour deviation of a schedule '''
+
+        worked = [0 for _ in self.roster.techs]
+        for shift, t in zip(self.calendar.shifts, assignment):
+            if t is not None:
+                worked[t] += shift.hours
+
+        return (sum(t is not None for t in assignment),
+                sum(abs(tech.hours - worked[t]) for t, tech in enumerate(self.roster.techs)))
+
+    def solveClasses(self, shop_model, classes, availability, conflicts):
+        ''' Settles coverage for classes of interchangeable techs first
+
+        The model over classes is far smaller and mostly free of the
+        symmetry between alike techs. Each class's shifts are then dealt out to its
+        techs, one class at a time. When that loses nothing against the
+        class model, coverage is held there and only pain is solved for
+        every tech, in a model of its own, returning the schedule.
+        Otherwise the schedule seeds the full model and None is returned.
+        '''
 
         techs = self.roster.techs
         shifts = self.calendar.shifts
+        targets = [tech.hours for tech in techs]
+        hours = [shift.hours for shift in shifts]
+        weeks = self.shiftWeeks()
+
+        class_model = shopModel.ClassModel(
+            classes, targets, hours, self.openShifts(availability),
+            shopModel.ShopModel.parseWindows(conflicts), weeks=weeks)
+        class_solver = shopSolver.ShopSolver(
+            class_model,
+            workers=self.args.workers,
+            time_limits=self.args.time_limit,
+            gap=self.args.gap,
+            progress=self.progress,
+            stall=self.args.stall,
+            accept=self.args.accept)
+        try:
+            solver = class_solver.solveCoverage()
+        except RuntimeError:
+            return None
+        grouped = class_model.assignment(solver)
+        filled = solver.Value(class_model.filled)
+        deviation = solver.Value(class_model.deviation)
+        accepted = class_solver.accepted
+
+        # Dealing out shares one phase's time between every class that needs it
+        dealt = [c for c, members in enumerate(classes)
+                 if len(members) > 1 and c in grouped]
+        member_limits = None
+        if self.args.time_limit and dealt:
+            member_limits = [self.args.time_limit[0] / (2 * len(dealt))]
+
+        assignment = [None for _ in shifts]
+        for c, members in enumerate(classes):
+            chosen = [s for s, g in enumerate(grouped) if g == c]
+            if len(members) == 1:
+                for s in chosen:
+                    assignment[s] = members[0]
+                continue
+            if not chosen:
+                continue
+
+            # Any of the class can work any of its shifts
+            member_model = shopModel.ShopModel(
+                [targets[t] for t in members],
+                [hours[s] for s in chosen],
+                np.ones((len(chosen), len(members)), dtype=bool),
+                shopModel.ShopModel.parseWindows(
+                    shopModel.ShopModel.restrictConflicts(conflicts, chosen)),
+                limits=[[20] * self.args.weeks for _ in members],
+                weeks=[weeks[s] for s in chosen])
+            member_solver = shopSolver.ShopSolver(
+                member_model,
+                workers=self.args.workers,
+                time_limits=member_limits,
+                gap=self.args.gap,
+                verbose=False,
+                stall=self.args.stall,
+                accept=self.args.accept)
+            member_solver.accepted = accepted
+            try:
+                solution = member_model.assignment(member_solver.solveCoverage())
+            except RuntimeError:
+                continue
+            finally:
+                accepted = accepted or member_solver.accepted
+            for s, m in zip(chosen, solution):
+                if m is not None:
+                    assignment[s] = members[m]
+
+        worked = [0 for _ in techs]
+        for s, t in enumerate(assignment):
+            if t is not None:
+                worked[t] += hours[s]
+
+        # An accepted schedule is final, whatever it scores
+        if accepted:
+            return assignment
+
+        shop_model.model.ClearHints()
+        shop_model.hintAssignment(assignment)
+        if (sum(t is not None for t in assignment) < filled or
+                sum(abs(target - worked[t]) for t, target in enumerate(targets)) > deviation):
+            print('Classes could not be split evenly, solving for every tech')
+            return None
+
+        # Whatever the class model proved about coverage holds for every tech;
+        # the constraints go in a copy so a failed solve leaves shop_model as it was
+        pinned_model = self.buildModel(availability, conflicts)
+        pinned_model.hintAssignment(assignment)
+        model = pinned_model.model
+        model.Add(pinned_model.filled >= filled)
+        model.Add(pinned_model.deviation <= deviation)
+        shop_solver = shopSolver.ShopSolver(
+            pinned_model,
+            workers=self.args.workers,
+            time_limits=self.args.time_limit,
+            gap=self.args.gap,
+            progress=self.progress,
+            stall=self.args.stall,
+            accept=self.args.accept)
+        try:
+            return pinned_model.assignment(shop_solver.solveSpread(deviation // max(len(techs), 1)))
+        except RuntimeError:
+            print('Could not even out hours for every tech, solving for every tech')
+            return None
+
+    def solve(self, shop_model):
+        ''' Solves the model as configured on the command line '''
+
+        shop_solver = shopSolver.ShopSolver(
+            shop_model,
+            workers=self.args.workers,
+            time_limits=self.args.time_limit,
+            gap=self.args.gap,
+            progress=self.progress,
+            stall=self.args.stall,
+            accept=self.args.accept)
+
+        if self.args.weighted:
+            return shop_solver.solveWeighted()
+        return shop_solver.solve()
+
+    def solveDecomposed(self, availability, conflicts):
+        ''' Solves independent groups of shifts and techs in parallel '''
+
+        decomposer = shopDecompose.ShopDecomposer(
+            [tech.hours for tech in self.roster.techs],
+            [shift.hours for shift in self.calendar.shifts],
+            self.openShifts(availability),
+            conflicts,
+            processes=self.args.decompose or None,
+            weeks=self.shiftWeeks(),
+            workers=self.args.workers or 1,
+            time_limits=self.args.time_limit,
+            gap=self.args.gap,
+            progress=self.progress,
+            stall=self.args.stall,
+            accept=self.args.accept)
+
+        return decomposer.solve()
+
+    def assign(self, assignment, availability, conflicts):
+        ''' Hands out shifts from a solution and lists who could cover them '''
 
-        for tech in techs:
-            tech.hours = int((tech.hours * (7 - sum(tech.by_day[self.args.week-1]))) // 7)
-        
-        overlaps, conflicts = self.parseConflicts(shifts)
-        availability = self.parseAvailability(shifts, techs)
-
-        for s in range(len(self.calendar.shifts)):
-            for c in range(s, conflicts[s]):
-                if shifts[c].tech is not None:
-                    availability[s][shifts[c].tech] = False
-
-        for s in range(len(self.calendar.shifts)-1, -1, -1):
-            if shifts[s].old:
-                del shifts[s]
-                del availability[s]
-    
-        overlaps, conflicts = self.parseConflicts(shifts)
-
-        model = cp_model.CpModel()
-        all_vars = []
-        tech_vars = [[] for _ in techs]
-        shift_vars = [[] for _ in shifts]
-        abs_vars = []
-        abs_abs_vars = []
-        
-        for t, tech in enumerate(techs):
-            for s, shift in enumerate(shifts):
-                if availability[s][t] == 0 or shift.tech is not None:
-                    var = model.NewIntVar(0, 0, 'v[%i,%i]' % (t, s))
-                else:
-                    var = model.NewIntVar(0, 1, 'v[%i,%i]' % (t, s))
-
-                all_vars.append(var)
-                tech_vars[t].append(var)    # Track variables for each tech
-                shift_vars[s].append(var)   # Track variables for each shift
-
-        for t, tech in enumerate(techs):
-
-            terms = [(tech_vars[t][s], shift.hours) for s, shift in enumerate(shifts)]
-            model.AddLinearConstraint(terms, 0, 20)
-            
-            hour_var = model.NewIntVar(-20, 20, 'h[%i]' % t)
-            hours = sum([tech_vars[t][s] * shift.hours for s, shift in enumerate(shifts)])
-            model.Add(hour_var == tech.hours - hours)
-            if tech.hours == 0:
-                model.Add(hour_var == 0)
-            
-            abs_var = model.NewIntVar(0, 20, 'a[%i]' % t)
-            abs_vars.append(abs_var)
-            model.AddAbsEquality(abs_var, hour_var)
+        techs = self.roster.techs
+        shifts = self.calendar.shifts
 
-        for s, shift in enumerate(shifts):
-            model.AddSumConstraint(shift_vars[s], 0, 1)
-        
-        for t, tech in enumerate(techs):
-            for s, shift in enumerate(shifts):
-                model.AddSumConstraint(tech_vars[t][s:conflicts[s]], 0, 1)
-        
-        # Optimize the number of shifts filled
-        model.Maximize(sum(all_vars)) 
-        solver = cp_model.CpSolver()
-        status = solver.Solve(model)
-        print(solver.ObjectiveValue())
-        model.Add(sum(all_vars) >= int(solver.ObjectiveValue()))
-
-        # Optimize the sum of differences
-        model.Minimize(sum(abs_vars))
-        solver = cp_model.CpSolver()
-        status = solver.Solve(model)
-        print(solver.ObjectiveValue())
-        model.Add(sum(abs_vars) <= int(solver.ObjectiveValue()))
-       
-        pain = int(solver.ObjectiveValue() // len(techs))
-
-        for t, tech in enumerate(techs):
-            pain_var = model.NewIntVar(-20, 20, 'p[%i]' % t)
-            abs_abs_var = model.NewIntVar(0, 20, 'aa[%i]' % t)
-            abs_abs_vars.append(abs_abs_var)
-            model.Add(pain_var == pain - abs_vars[t])
-            model.AddAbsEquality(abs_abs_var, pain_var)
-        
-        # Evenly distribute pain
-        model.Minimize(sum(abs_abs_vars))
-        solver = cp_model.CpSolver()
-        status = solver.Solve(model)
-        print(solver.ObjectiveValue())
-        model.Add(sum(abs_abs_vars) <= int(solver.ObjectiveValue()))
-     
         # Parse solution
-        for t, tech in enumerate(techs):
-            for s, shift in enumerate(shifts):
-                if solver.Value(tech_vars[t][s]):
-                    shift.tech = t
-                    tech.shifts.append(shift)
-
         for s, shift in enumerate(shifts):
-            for c in range(s, conflicts[s]):
-                if shifts[c].tech is not None:
-                    availability[s][shifts[c].tech] = False
+            if assignment[s] is not None:
+                shift.tech = assignment[s]
+                techs[assignment[s]].shifts.append(shift)
+
+        self.blockAssigned(availability, conflicts)
 
         for s, shift in enumerate(shifts):
             for t, tech in enumerate(techs):
-                name = '{} {:1.1}'.format(tech.first, tech.last)
-                name = tech.nick if tech.nick else name
                 if availability[s][t]:
-                    shift.covers.append(name)
+                    shift.covers.append(tech.getName())
 
-        # Print solution
-        for tech in techs:
-            print(tech)
+    def schedule(self):
+        ''' Assigns techs to the week's shifts and prints the result '''
+
+        trace = shopTrace.trace
+        with trace.stage('prepare'):
+            availability, conflicts = self.prepare()
+        if self.args.decompose is not None:
+            with trace.stage('solve'):
+                assignment = self.solveDecomposed(availability, conflicts)
+        elif self.args.fast:
+            with trace.stage('solve'):
+                assignment = self.solveQuick(availability, conflicts)
+            print('filled: {} deviation: {} (heuristic)'.format(*self.scoreSchedule(assignment)))
+        else:
+            if self.args.accept and sys.stdin.isatty():
+                print('Press Enter to accept the best schedule so far')
+
+            # The quick schedule seeds the solver and stands in if it finds nothing
+            with trace.stage('heuristic'):
+                quick = self.solveQuick(availability, conflicts)
+            with trace.stage('buildModel'):
+                shop_model = self.buildModel(availability, conflicts)
+                shop_model.hintAssignment(quick)
+            trace.recordModel('built', shop_model.model)
+
+            # Alike techs are solved as one first, which may settle the week;
+            # the stage solves phase by phase, so --weighted goes straight to solve
+            classes = shopModel.ShopModel.parseClasses(
+                [tech.hours for tech in self.roster.techs], self.openShifts(availability))
+            assignment = None
+            if len(classes) < len(self.roster.techs) and not self.args.weighted:
+                with trace.stage('classes'):
+                    assignment = self.solveClasses(shop_model, classes, availability, conflicts)
+            if assignment is None:
+                with trace.stage('solve'):
+                    try:
+                        assignment = shop_model.assignment(self.solve(shop_model))
+                    except RuntimeError as error:
+                        print('{}, keeping the quick schedule'.format(error))
+                        assignment = quick
+
+            # A solve cut short by its time limit can trail the quick schedule
+            filled, deviation = self.scoreSchedule(assignment)
+            quick_filled, quick_deviation = self.scoreSchedule(quick)
+            if (quick_filled, -quick_deviation) > (filled, -deviation):
+                print('Quick schedule is better (filled: {} deviation: {}), keeping it'.format(
+                    quick_filled, quick_deviation))
+                assignment = quick
+
+        with trace.stage('assign'):
+            self.assign(assignment, availability, conflicts)
+
+        self.printSchedule()
+
+    def loadAssignments(self):
+        ''' Reads who holds each shift from the names posted on the calendar '''
+
+        names = {tech.getName(): t for t, tech in enumerate(self.roster.techs)}
+        return [names.get(shift.event.get('summary', '')) for shift in self.calendar.shifts]
+
+    def freeShifts(self, held, availability, conflicts):
+        ''' Hands back the posted shifts that still work and frees the rest
+
+        Returns the freed shifts, as chosen by ShopModel.parseRepair.
+        '''
+
+        freed = shopModel.ShopModel.parseRepair(held, availability, conflicts)
+        for s, shift in enumerate(self.calendar.shifts):
+            shift.tech = held[s]
+        for s in freed:
+            self.calendar.shifts[s].tech = None
+
+        return freed
+
+    def buildRepair(self, freed, availability, conflicts):
+        ''' Builds the CP-SAT model over the freed shifts alone '''
+
+        shifts = self.calendar.shifts
+        return shopModel.ShopModel.repairModel(
+            [tech.hours for tech in self.roster.techs],
+            [shift.hours for shift in shifts],
+            [shift.tech for shift in shifts],
+            freed, availability, conflicts)
+
+    def solveQuickRepair(self, freed, availability, conflicts):
+        ''' Refills the freed shifts with the heuristic instead of CP-SAT
+
+        Takes the same targets, kept hours and limits as buildRepair.
+        '''
+
+        shifts = self.calendar.shifts
+        worked = [0 for _ in self.roster.techs]
         for shift in shifts:
-            if not shift.tech:
+            if shift.tech is not None:
+                worked[shift.tech] += shift.hours
+
+        heuristic = shopHeuristic.ShopHeuristic(
+            [tech.hours for tech in self.roster.techs],
+            [shifts[s].hours for s in freed],
+            availability[freed],
+            shopModel.ShopModel.restrictConflicts(conflicts, freed),
+            limits=[[max(20 - hours, 0)] for hours in worked],
+            worked=worked)
+
+        return heuristic.solve()
+
+    def repair(self):
+        ''' Patches the posted schedule around techs who can no longer work
+
+        Only freed shifts go into the model, so the solve grows with the
+        size of the change rather than the week.
+        '''
+
+        trace = shopTrace.trace
+        techs = self.roster.techs
+        shifts = self.calendar.shifts
+
+        with trace.stage('prepare'):
+            availability, conflicts = self.prepare()
+            held = self.loadAssignments()
+
+            names = {tech.getName(): t for t, tech in enumerate(techs)}
+            for name in self.args.drop:
+                if name not in names:
+                    raise ValueError('No tech named {}'.format(name))
+                availability[:, names[name]] = False
+
+            freed = self.freeShifts(held, availability, conflicts)
+            self.blockAssigned(availability, conflicts)
+
+        with trace.stage('buildModel'):
+            shop_model = self.buildRepair(freed, availability, conflicts)
+        trace.recordModel('built', shop_model.model)
+
+        if self.args.accept and sys.stdin.isatty():
+            print('Press Enter to accept the best schedule so far')
+        with trace.stage('solve'):
+            shop_solver = shopSolver.ShopSolver(
+                shop_model,
+                workers=self.args.workers,
+                time_limits=self.args.time_limit,
+                gap=self.args.gap,
+                progress=self.progress,
+                stall=self.args.stall,
+                accept=self.args.accept)
+            try:
+                solution = shop_model.assignment(shop_solver.solveRepair([held[s] for s in freed]))
+            except RuntimeError as error:
+                print('{}, keeping the quick repair'.format(error))
+                solution = self.solveQuickRepair(freed, availability, conflicts)
+
+        assignment = [shift.tech for shift in shifts]
+        for s, t in zip(freed, solution):
+            assignment[s] = t
+
+        with trace.stage('assign'):
+            self.assign(assignment, availability, conflicts)
+
+        self.printSchedule()
+        for s in freed:
+            if held[s] is not None and held[s] != shifts[s].tech:
+                print('Moved: {} ({} -> {})'.format(
+                    shifts[s], techs[held[s]].getName(),
+                    techs[shifts[s].tech].getName() if shifts[s].tech is not None else 'nobody'))
+
+    def close(self):
+        ''' Closes the progress file, if solutions are being written to one '''
+
+        if self.progress_file:
+            self.progress_file.close()
+            self.progress_file = None
+
+    def printSchedule(self):
+        ''' Prints each tech's hours and the shifts left open '''
+
+        for tech in self.roster.techs:
+            print(tech)
+        for shift in self.calendar.shifts:
+            if shift.tech is None:
                 print('Not filled: {}'.format(shift))
 
-        # Dry run, exit after printing
-        if self.args.dry:
-            exit(1)
-    
+    def publish(self):
+        ''' Posts the schedule and emails techs, once confirmed '''
+
         # Update calendars
         print('Post? y/N')
         x = input()
         if x != 'y':
             exit(1)
-        self.calendar.postEvents(techs)
+
+        # Emails are composed while the calendar updates are in flight
+        with futures.ThreadPoolExecutor(max_workers=1) as pool:
+            messages = pool.submit(self.roster.composeEmails)
+            report = self.calendar.postEvents(self.roster.techs)
+        for shift, result in report.items():
+            if not result['ok']:
+                print('Not posted: {} ({})'.format(shift, result['error']))
 
         # Send notifications
         print('Email? y/N')
         x = input()
         if x != 'y':
             exit(1)
-        self.roster.sendEmails()
+        outbox = os.path.join('outbox', '{}-week{}.json'.format(self.anchor, self.args.week))
+        self.roster.gmail = self.provider.get_service('gmail')
+        self.roster.sendEmails(outbox=outbox, messages=messages.result())
+
+def main(args):
+    ''' Runs the scheduler as asked on the command line '''
+
+    provider, config = None, None
+    if args.fake:
+        import shopFake
+        provider, config = shopFake.makeShop(*args.fake, week=args.week, weeks=args.weeks)
+
+    try:
+        s = ShopScheduler(args, provider, config)
+    except ValueError as error:
+        sys.exit(error)
+
+    # The progress file is closed however the run ends, prompts included
+    try:
+        if args.snapshot:
+            shopSnapshot.saveSnapshot(args.snapshot, s)
+    
+        if args.nuke:
+            print('Nuke week {}? y/N'.format(args.week))
+            x = input()
+            if x != 'y':
+                exit(1)
+            if not args.dry:
+                report = s.calendar.nukeEvents()
+                for shift, result in report.items():
+                    if not result['ok']:
+                        print('Not reset: {} ({})'.format(shift, result['error']))
+
+        if args.repair:
+            s.repair()
+        else:
+            s.schedule()
+
+        # Dry run, exit after printing
+        if args.dry:
+            exit(1)
+
+        s.publish()
+    finally:
+        s.close()
 
 if __name__ == '__main__':
     
@@ -254,18 +639,49 @@ if __name__ == '__main__':
         epilog='Brought to you by Scarborough'
     )
     parser.add_argument('week', type=int, help='week of the quarter')
+    parser.add_argument('--weeks', type=int, default=1, help='schedule this many weeks together, balancing hours across them')
     parser.add_argument('-n', '--nuke', action='store_true', help='unassign all shifts for the week')
     parser.add_argument('-d', '--dry', action='store_true', help='print the schedule, but do not update the calendars')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='CP-SAT search workers (0 picks automatically)')
+    parser.add_argument('-l', '--time-limit', type=float, nargs='+', help='seconds allowed per solve phase, one value for all or one per phase')
+    parser.add_argument('-g', '--gap', type=float, default=0.0, help='stop a phase once within this relative gap of optimal')
+    parser.add_argument('--progress', nargs='?', const='-', metavar='PATH', help='print each improving solution, or write them to PATH as JSON lines')
+    parser.add_argument('--stall', type=float, default=0, metavar='SECONDS', help='end a phase once it has gone this long without improving')
+    parser.add_argument('--accept', action='store_true', help='press Enter during a solve to accept the best schedule so far')
+    parser.add_argument('--weighted', action='store_true', help='solve all objectives in one weighted pass')
+    parser.add_argument('--fast', action='store_true', help='schedule with a quick heuristic instead of CP-SAT, for previews')
+    parser.add_argument('--decompose', type=int, nargs='?', const=0, metavar='PROCESSES', help='solve independent groups of shifts in parallel processes (0 uses every core)')
+    parser.add_argument('--repair', action='store_true', help='keep the posted schedule, reassigning only the shifts that no longer work')
+    parser.add_argument('--drop', action='append', default=[], metavar='NAME', help='take a tech off the schedule when repairing (repeatable)')
+    parser.add_argument('--fake', type=int, nargs=2, metavar=('TECHS', 'SHIFTS'), help='run against a synthetic shop instead of Google')
+    parser.add_argument('--sync', action='store_true', help='keep a local copy of the calendars and fetch only what changed since the last run')
+    parser.add_argument('--no-cache', action='store_true', help='always download the roster, even if it is unchanged')
+    parser.add_argument('--snapshot', metavar='PATH', help='save the loaded roster and shifts for replay')
+    parser.add_argument('--from-snapshot', metavar='PATH', help='replay a saved snapshot offline instead of fetching (implies --dry)')
+    parser.add_argument('--trace', metavar='PATH', help='write stage timings, API calls and solver statistics as JSON')
+    parser.add_argument('--profile', metavar='PATH', help='write cProfile statistics for the run')
     args = parser.parse_args()
-    
-    s = ShopScheduler(args)
-    
-    if args.nuke:
-        print('Nuke week {}? y/N'.format(args.week))
-        x = input()
-        if x != 'y':
-            exit(1)
-        if not args.dry:
-            s.calendar.nukeEvents()
-
-    s.schedule()
+    if args.repair and args.weeks > 1:
+        parser.error('--repair works on one week at a time')
+    if args.fast and (args.repair or args.decompose is not None):
+        parser.error('--fast cannot be combined with --repair or --decompose')
+    if args.decompose is not None and args.progress not in (None, '-'):
+        parser.error('--progress PATH cannot be combined with --decompose; use --progress alone to print')
+    if args.decompose is not None and args.accept:
+        parser.error('--accept cannot be combined with --decompose')
+    if args.from_snapshot:
+        args.dry = True
+
+    profile = cProfile.Profile() if args.profile else None
+    if profile:
+        profile.enable()
+
+    # Traces and profiles are written even when the run exits early
+    try:
+        main(args)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+        if args.trace:
+            shopTrace.trace.save(args.trace)
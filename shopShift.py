@@ -1,28 +1,159 @@
-import datetime
+import numpy as np
+
+_HOUR = np.timedelta64(1, 'h')
+
+class ShiftTable(object):
+
+   def __init__(self, events, starts, ends):
+      ''' Columns of parsed shift times, shared by the Shifts viewing them
+
+      events[i] is the event of row i, and starts[i] and ends[i] its local
+      times as ISO strings. Times are kept as datetime64 seconds, hours as
+      integers and calendars as indices into cals.
+      '''
+
+      self.events = events
+      self.start = np.array([start[:19] for start in starts], dtype='datetime64[s]')
+      self.end = np.array([end[:19] for end in ends], dtype='datetime64[s]')
+      self.hours = (self.end - self.start) // _HOUR
+
+      names = [event['organizer']['displayName'] for event in events]
+      cals, codes = np.unique(np.array(names, dtype=str), return_inverse=True)
+      self.cals = cals.tolist()
+      self.cal = codes.astype(np.int32)
+
+   @staticmethod
+   def fromEvents(items):
+      ''' Parses a whole list of calendar events in one pass
+
+      All-day events have a date rather than a time and are not shifts,
+      nor are events without an organizer to name their calendar.
+      '''
+
+      events, starts, ends = [], [], []
+      for item in items:
+         try:
+            start, end = item['start']['dateTime'], item['end']['dateTime']
+            item['organizer']['displayName']
+         except KeyError:
+            continue
+         events.append(item)
+         starts.append(start)
+         ends.append(end)
+
+      return ShiftTable(events, starts, ends)
+
+   def shifts(self, cutoff=None):
+      ''' Returns a Shift viewing each row, old if it starts before cutoff '''
+
+      if cutoff:
+         old = (self.start < np.datetime64(cutoff, 's')).tolist()
+      else:
+         old = [True] * len(self.events)
+
+      shifts = []
+      for row, is_old in enumerate(old):
+         shift = Shift.__new__(Shift)
+         shift.table = self
+         shift.row = row
+         shift.old = is_old
+         shift.tech = None
+         shift.covers = []
+         shifts.append(shift)
+
+      return shifts
+
+def gatherTimes(shifts):
+   ''' Returns the starts and ends of shifts as datetime64 arrays
+
+   Rows are copied out of each table the shifts view in one go, rather
+   than converting every shift's times.
+   '''
+
+   start = np.empty(len(shifts), dtype='datetime64[s]')
+   end = np.empty(len(shifts), dtype='datetime64[s]')
+
+   groups = {}
+   for s, shift in enumerate(shifts):
+      groups.setdefault(shift.table, []).append((s, shift.row))
+   for table, pairs in groups.items():
+      positions, rows = np.array(pairs, dtype=np.intp).T
+      start[positions] = table.start[rows]
+      end[positions] = table.end[rows]
+
+   return start, end
 
 class Shift(object):
 
-   __slots__ = ['start', 'end', 'hours', 'cal', 
-                'event', 'old', 'tech', 'covers']
+   __slots__ = ['table', 'row', 'old', 'tech', 'covers']
 
    def __init__(self, event, **kwargs):
-      ''' Initializes the shift from a Google Calendar event '''
+      ''' Initializes the shift from a Google Calendar event
 
-      strptime = datetime.datetime.strptime
-      hour = datetime.timedelta(hours = 1)
-      fmt = '%Y-%m-%dT%H:%M:%S'
+      The shift views a table of its own; shifts parsed together share
+      one, from ShiftTable.fromEvents.
+      '''
 
-      self.event = event
-      self.start = strptime(event['start']['dateTime'][:19], fmt)
-      self.end = strptime(event['end']['dateTime'][:19], fmt)
-      self.hours = (self.end - self.start) // hour
-      self.cal = event['organizer']['displayName']
+      self.table = ShiftTable(
+         [event], [event['start']['dateTime']], [event['end']['dateTime']])
+      self.row = 0
       self.covers = []
 
       self.tech = kwargs.get('tech', None)
       cutoff = kwargs.get('cutoff', None)
       self.old = self.start < cutoff if cutoff else True
 
+   @property
+   def event(self):
+      return self.table.events[self.row]
+
+   @property
+   def start(self):
+      return self.table.start[self.row].item()
+
+   @property
+   def end(self):
+      return self.table.end[self.row].item()
+
+   @property
+   def hours(self):
+      return int(self.table.hours[self.row])
+
+   @property
+   def cal(self):
+      return self.table.cals[self.table.cal[self.row]]
+
+   def getState(self):
+      ''' Returns the parsed shift as plain values for a snapshot '''
+
+      return {
+         'event': self.event,
+         'start': self.start.isoformat(),
+         'end': self.end.isoformat(),
+         'old': self.old,
+         'tech': self.tech}
+
+   @staticmethod
+   def fromState(state):
+      ''' Rebuilds a shift from getState without parsing event times '''
+
+      return Shift.fromStates([state])[0]
+
+   @staticmethod
+   def fromStates(states):
+      ''' Rebuilds shifts from getState, sharing one table '''
+
+      table = ShiftTable(
+         [state['event'] for state in states],
+         [state['start'] for state in states],
+         [state['end'] for state in states])
+
+      shifts = table.shifts()
+      for shift, state in zip(shifts, states):
+         shift.old = state['old']
+         shift.tech = state['tech']
+      return shifts
+
    def __str__(self): 
       ''' Pretty-prints shift information '''
 
@@ -41,13 +172,33 @@ class Shift(object):
       if self.tech is None:
          return None
 
-      tech = techs[self.tech]
-      name = '{} {:1.1}'.format(tech.first, tech.last)
-      name = tech.nick if tech.nick else name 
-      self.event['summary'] = name
-      self.event['description'] = '\n'.join(self.covers)
+      name = techs[self.tech].getName()
+      return self.patchEvent(gcalendar, name, '\n'.join(self.covers))
+
+   def patchEvent(self, gcalendar, summary, description):
+      ''' Returns a request to change the event, or None if it is current
+
+      Only the fields that differ from the fetched event are sent, and the
+      patch only applies if the event has not changed since it was fetched.
+      The event itself is left alone until the write succeeds.
+      '''
+
+      body = {}
+      if self.event.get('summary', '') != summary:
+         body['summary'] = summary
+      if self.event.get('description', '') != description:
+         body['description'] = description
 
-      return gcalendar.events().update(
+      if not body:
+         return None
+
+      request = gcalendar.events().patch(
          calendarId=self.event['organizer']['email'],
          eventId=self.event['id'],
-         body=self.event)
+         fields='etag,summary,description',
+         body=body)
+
+      if 'etag' in self.event:
+         request.headers['If-Match'] = self.event['etag']
+
+      return request
@@ -0,0 +1,79 @@
+import shopShift
+import shopTech
+
+import os
+import gzip
+import json
+
+# Bumped whenever the layout changes; older snapshots are refused
+_VERSION = 1
+
+class Snapshot(object):
+
+    def __init__(self, anchor, calendars, spreadsheet, week, weeks, techs, shifts):
+        ''' The parsed roster and calendar inputs of one run
+
+        Has the anchor, calendars and spreadsheet of shopConfig, so a
+        snapshot can stand in for it when a run is replayed.
+        '''
+
+        self.anchor = anchor
+        self.calendars = calendars
+        self.spreadsheet = spreadsheet
+        self.week = week
+        self.weeks = weeks
+        self.techs = techs
+        self.shifts = shifts
+
+def saveState(path, data):
+    ''' Writes plain values as gzipped JSON, stamped with the layout version '''
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # Written aside and renamed so a failed write leaves no partial file
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+        json.dump(dict(data, version=_VERSION), f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+
+def loadState(path):
+    ''' Reads values written by saveState, refusing other layout versions '''
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if data.get('version') != _VERSION:
+        raise ValueError('{} is version {}, expected {}'.format(
+            path, data.get('version'), _VERSION))
+
+    return data
+
+def saveSnapshot(path, scheduler):
+    ''' Writes the techs and shifts a scheduler loaded
+
+    Call before prepare, which scales hours and drops old shifts.
+    '''
+
+    saveState(path, {
+        'anchor': scheduler.anchor,
+        'calendars': scheduler.calendar.cal_ids,
+        'spreadsheet': scheduler.roster.sheet_id,
+        'week': scheduler.calendar.week,
+        'weeks': scheduler.calendar.weeks,
+        'techs': [tech.getState() for tech in scheduler.roster.techs],
+        'shifts': [shift.getState() for shift in scheduler.calendar.shifts],
+    })
+
+def loadSnapshot(path):
+    ''' Reads a snapshot written by saveSnapshot '''
+
+    data = loadState(path)
+    return Snapshot(
+        data['anchor'],
+        data['calendars'],
+        data['spreadsheet'],
+        data['week'],
+        data['weeks'],
+        [shopTech.Tech.fromState(state) for state in data['techs']],
+        shopShift.Shift.fromStates(data['shifts']))
@@ -0,0 +1,287 @@
+from ortools.sat.python import cp_model
+
+import shopTrace
+
+import sys
+import json
+import select
+import threading
+
+_PHASES = ['filled', 'deviation', 'pain', 'weighted', 'kept']
+_WEIGHTED = 3
+_KEPT = 4
+
+def printProgress(record):
+    ''' Prints one improving solution '''
+
+    print('  {phase}: {objective:g}, bound {bound:g}, gap {gap:.1%}, {unfilled} unfilled ({seconds:.1f} s)'.format(
+        **record))
+
+def streamProgress(stream):
+    ''' Returns a progress callback that writes each solution to stream as a JSON line '''
+
+    def write(record):
+        stream.write(json.dumps(record) + '\n')
+        stream.flush()
+
+    return write
+
+class ShopProgress(cp_model.CpSolverSolutionCallback):
+
+    def __init__(self, phase, shop_model, progress=None, stall=0):
+        ''' Reports each improving solution of a phase and stops stalled searches
+
+        progress is called with a record of each solution; stall stops the
+        search once that many seconds pass without a better one.
+        '''
+
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self.phase = phase
+        self.shop_model = shop_model
+        self.progress = progress
+        self.stall = stall
+        self.timer = None
+
+    def on_solution_callback(self):
+        if self.progress:
+            objective = self.ObjectiveValue()
+            bound = self.BestObjectiveBound()
+            self.progress({
+                'phase': _PHASES[self.phase],
+                'seconds': round(self.WallTime(), 3),
+                'objective': objective,
+                'bound': bound,
+                'gap': abs(objective - bound) / max(abs(objective), 1),
+                'unfilled': len(self.shop_model.shift_vars) - self.Value(self.shop_model.filled)})
+
+        if self.stall:
+            self.cancel()
+            self.timer = threading.Timer(self.stall, self.StopSearch)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def cancel(self):
+        if self.timer:
+            self.timer.cancel()
+
+class ShopSolver(object):
+
+    def __init__(self, shop_model, workers=0, time_limits=None, gap=0.0, verbose=True,
+                 progress=None, stall=0, accept=False):
+        ''' Solves a ShopModel phase by phase
+
+        workers sets num_search_workers (0 lets CP-SAT decide), time_limits
+        gives the seconds allowed for each phase (a single value applies to
+        every phase; the weighted solve gets their total) and gap stops a
+        phase once the relative gap to its bound falls below it. verbose
+        prints each phase's result.
+
+        progress is called with each improving solution, as printProgress
+        or streamProgress; stall ends a phase that many seconds after its
+        last improvement; accept lets Enter on the console end the solve
+        with the best schedule so far, skipping any phases left. Setting
+        accepted before solving, to carry an acceptance over from another
+        solver, makes each phase take the first schedule it finds.
+        '''
+
+        time_limits = time_limits or []
+        if len(time_limits) == 1:
+            time_limits = time_limits * _WEIGHTED
+
+        self.shop_model = shop_model
+        self.workers = workers
+        self.time_limits = time_limits
+        self.gap = gap
+        self.verbose = verbose
+        self.progress = progress
+        self.stall = stall
+        self.accept = accept
+        self.accepted = False
+        self.solver = None
+        self.phases = []
+
+    def createSolver(self, phase):
+        ''' Creates a CP-SAT solver configured for a phase '''
+
+        solver = cp_model.CpSolver()
+        if self.workers:
+            solver.parameters.num_search_workers = self.workers
+        if phase == _WEIGHTED:
+            limit = sum(self.time_limits)
+        elif phase == _KEPT:
+            # Keeping shifts with their holders is part of coverage
+            limit = self.time_limits[0] if self.time_limits else 0
+        else:
+            limit = self.time_limits[phase] if phase < len(self.time_limits) else 0
+        if limit:
+            solver.parameters.max_time_in_seconds = limit
+        if self.gap:
+            solver.parameters.relative_gap_limit = self.gap
+
+        # A schedule accepted before this solver ran only needs one of its own
+        if self.accepted:
+            solver.parameters.stop_after_first_solution = True
+        return solver
+
+    def hint(self, solver):
+        ''' Seeds the model with the values of the last solution '''
+
+        model = self.shop_model.model
+        solution = solver.ResponseProto().solution
+
+        model.ClearHints()
+        for index, value in enumerate(solution):
+            model.AddHint(model.GetIntVarFromProtoIndex(index), value)
+
+    def solvePhase(self, phase, objective, maximize=False):
+        ''' Optimizes one objective, starting from the previous solution '''
+
+        # Once a schedule is accepted, later phases keep it as it is
+        if self.accepted and self.solver is not None:
+            return self.solver
+
+        model = self.shop_model.model
+        if maximize:
+            model.Maximize(objective)
+        else:
+            model.Minimize(objective)
+
+        solver = self.createSolver(phase)
+        shopTrace.trace.recordModel(_PHASES[phase], model)
+        if self.progress or self.stall or self.accept:
+            callback = ShopProgress(phase, self.shop_model, self.progress, self.stall)
+            done = threading.Event()
+            # Only a terminal can press Enter; piped input is for the prompts
+            if self.accept and sys.stdin.isatty():
+                threading.Thread(target=self.listen, args=(callback, done), daemon=True).start()
+            status = solver.Solve(model, callback)
+            done.set()
+            callback.cancel()
+        else:
+            status = solver.Solve(model)
+
+        stats = {
+            'phase': _PHASES[phase],
+            'status': solver.StatusName(status),
+            'seconds': solver.WallTime(),
+            'objective': solver.ObjectiveValue(),
+            'bound': solver.BestObjectiveBound(),
+            'conflicts': solver.NumConflicts(),
+            'branches': solver.NumBranches()}
+        self.phases.append(stats)
+        shopTrace.trace.recordPhase(stats)
+
+        # Keep the previous phase's schedule if this one ran out of time
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            if self.solver is None:
+                raise RuntimeError('No schedule found: {}'.format(
+                    solver.StatusName(status)))
+            if self.verbose:
+                print('{}: {}'.format(_PHASES[phase], solver.StatusName(status)))
+            return self.solver
+
+        if self.verbose:
+            print('{}: {} ({})'.format(
+                _PHASES[phase], solver.Value(objective), solver.StatusName(status)))
+
+        self.hint(solver)
+        self.solver = solver
+        return solver
+
+    def listen(self, callback, done):
+        ''' Accepts the best schedule so far when Enter is pressed during a phase
+
+        Polls rather than blocking on stdin, so nothing typed after the
+        solve is taken from the prompts that follow.
+        '''
+
+        while not done.is_set():
+            ready, _, _ = select.select([sys.stdin], [], [], 0.1)
+            if ready and not done.is_set():
+                # An empty read is the end of input, not Enter
+                if not sys.stdin.readline():
+                    return
+                self.accepted = True
+                callback.StopSearch()
+                return
+
+    def solve(self):
+        ''' Fills shifts, then matches hours, then evens out pain '''
+
+        solver = self.solveCoverage()
+        deviation = solver.Value(self.shop_model.deviation)
+        return self.solveSpread(deviation // max(len(self.shop_model.abs_vars), 1))
+
+    def solveCoverage(self):
+        ''' Fills shifts, then matches hours, keeping both optimal after '''
+
+        shop_model = self.shop_model
+        model = shop_model.model
+
+        # Optimize the number of shifts filled
+        solver = self.solvePhase(0, shop_model.filled, maximize=True)
+        model.Add(shop_model.filled >= solver.Value(shop_model.filled))
+
+        # Optimize the sum of differences
+        solver = self.solvePhase(1, shop_model.deviation)
+        model.Add(shop_model.deviation <= solver.Value(shop_model.deviation))
+
+        return solver
+
+    def solveRepair(self, previous):
+        ''' Fills shifts while moving as few of them as possible
+
+        previous[s] is the tech who held shift s before, or None. Coverage
+        comes first, then keeping shifts with their holders, then hours and
+        pain as in solve.
+        '''
+
+        shop_model = self.shop_model
+        model = shop_model.model
+        shop_model.hintAssignment(previous)
+
+        solver = self.solvePhase(0, shop_model.filled, maximize=True)
+        model.Add(shop_model.filled >= solver.Value(shop_model.filled))
+
+        kept = cp_model.LinearExpr.Sum([shop_model.shift_vars[s][t]
+                                        for s, t in enumerate(previous)
+                                        if t in shop_model.shift_vars[s]])
+        solver = self.solvePhase(_KEPT, kept, maximize=True)
+        model.Add(kept >= solver.Value(kept))
+
+        solver = self.solvePhase(1, shop_model.deviation)
+        model.Add(shop_model.deviation <= solver.Value(shop_model.deviation))
+
+        deviation = solver.Value(shop_model.deviation)
+        return self.solveSpread(deviation // max(len(shop_model.abs_vars), 1))
+
+    def solveSpread(self, pain):
+        ''' Evenly distributes pain around the given typical deviation '''
+
+        spread = cp_model.LinearExpr.Sum(self.shop_model.addPain(pain))
+        return self.solvePhase(2, spread)
+
+    def solveWeighted(self):
+        ''' Solves all three objectives at once with a weighted sum
+
+        Each objective is weighted above the largest possible value of the
+        ones after it, so a proven optimum matches the phased solve; with a
+        time limit or gap the answer is approximate.
+        '''
+
+        shop_model = self.shop_model
+        model = shop_model.model
+        techs = max(len(shop_model.abs_vars), 1)
+
+        filled = shop_model.filled
+        deviation = shop_model.deviation
+
+        pain = model.NewIntVar(0, shop_model.span, 'pain')
+        model.AddDivisionEquality(pain, deviation, techs)
+        shop_model.addPain(pain)
+        spread = cp_model.LinearExpr.Sum(shop_model.abs_abs_vars)
+
+        # Deviation and spread are each at most span hours per tech
+        weight = shop_model.span * techs + 1
+        return self.solvePhase(
+            _WEIGHTED, weight * weight * filled - weight * deviation - spread, maximize=True)
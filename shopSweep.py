@@ -0,0 +1,263 @@
+import shopModel
+import shopSolver
+import shopHeuristic
+import shopScheduler
+
+import sys
+import json
+import time
+import argparse
+import datetime
+
+from concurrent import futures
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday',
+              'Friday', 'Saturday', 'Sunday']
+
+# Arrays shared with this worker process, by name
+_shared = {}
+
+def shareArrays(arrays):
+    ''' Copies arrays into shared memory once for every worker to read
+
+    Returns the shared blocks, which the caller closes and unlinks when
+    done, and the specs a worker passes to attachArrays.
+    '''
+
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+
+    return blocks, specs
+
+def attachArrays(specs):
+    ''' Maps the shared arrays into a worker, without copying them '''
+
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared[name] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+def shared(name):
+    return _shared[name][1]
+
+def solveScenario(task):
+    ''' Solves one scenario against the shared week
+
+    Availability is copied only by scenarios that change it; the others
+    build their model straight from shared memory.
+    '''
+
+    start = time.perf_counter()
+    kept = np.ones(len(shared('hours')), dtype=bool)
+    kept[task['dropped']] = False
+    subset = [int(s) for s in np.nonzero(kept)[0]]
+
+    availability = shared('availability')
+    if task['dropped'] or task['blocks']:
+        availability = availability[subset]
+    days = shared('days')[subset]
+    for t, day in task['blocks']:
+        if day is None:
+            availability[:, t] = False
+        else:
+            availability[days == day, t] = False
+
+    targets = [int(target) for target in shared('targets')]
+    for t, target in task['targets'].items():
+        targets[t] = target
+
+    hours = [int(shared('hours')[s]) for s in subset]
+    weeks = [int(shared('weeks')[s]) for s in subset]
+    conflicts = shopModel.ShopModel.restrictConflicts(
+        [int(last) for last in shared('conflicts')], subset)
+
+    # As in ShopScheduler.schedule, the heuristic seeds the solve and
+    # stands in if it finds nothing in time
+    quick = shopHeuristic.ShopHeuristic(
+        targets, hours, availability, conflicts, weeks=weeks).solve()
+    shop_model = shopModel.ShopModel(
+        targets, hours, availability, shopModel.ShopModel.parseWindows(conflicts), weeks=weeks)
+    shop_model.hintAssignment(quick)
+    shop_solver = shopSolver.ShopSolver(shop_model, verbose=False, **task['options'])
+    try:
+        solution = shop_model.assignment(shop_solver.solve())
+    except RuntimeError:
+        solution = quick
+
+    worked = [0 for _ in targets]
+    for s, t in enumerate(solution):
+        if t is not None:
+            worked[t] += hours[s]
+    deviations = [abs(target - worked[t]) for t, target in enumerate(targets)]
+    pain = sum(deviations) // max(len(targets), 1)
+
+    assignment = [None for _ in kept]
+    for s, t in zip(subset, solution):
+        assignment[s] = t
+
+    return {
+        'name': task['name'],
+        'filled': sum(t is not None for t in solution),
+        'shifts': len(subset),
+        'deviation': sum(deviations),
+        'pain': sum(abs(pain - deviation) for deviation in deviations),
+        'phases': [phase['status'] for phase in shop_solver.phases],
+        'seconds': round(time.perf_counter() - start, 3),
+        'assignment': assignment}
+
+class ShopSweep(object):
+
+    def __init__(self, scheduler, processes=None, **options):
+        ''' Solves many variants of one week in parallel
+
+        The scheduler's week is prepared once; its availability, conflicts
+        and shift details are placed in shared memory for every worker.
+        options go to each scenario's ShopSolver.
+        '''
+
+        availability, conflicts = scheduler.prepare()
+        self.techs = scheduler.roster.techs
+        self.shifts = scheduler.calendar.shifts
+        self.names = {tech.getName(): t for t, tech in enumerate(self.techs)}
+        self.processes = processes
+        self.options = options
+
+        self.arrays = {
+            'availability': scheduler.openShifts(availability),
+            'conflicts': np.array(conflicts, dtype=np.int64),
+            'hours': np.array([shift.hours for shift in self.shifts], dtype=np.int64),
+            'weeks': np.array(scheduler.shiftWeeks(), dtype=np.int64),
+            'days': np.array([shift.start.weekday() for shift in self.shifts], dtype=np.int64),
+            'targets': np.array([tech.hours for tech in self.techs], dtype=np.int64)}
+
+    def makeTask(self, scenario):
+        ''' Resolves a scenario's edits to tech and shift indices
+
+        Each edit is one of
+            {"block": NAME, "day": "Thursday"}   NAME cannot work that day,
+                                                 or at all without a day
+            {"hours": NAME, "target": 12}        NAME should work 12 hours
+            {"drop": {"cal": CAL, "start": ISO}} the shift is not worked
+        '''
+
+        task = {'name': scenario['name'], 'blocks': [], 'targets': {}, 'dropped': [],
+                'options': self.options}
+        for edit in scenario.get('edits', []):
+            if 'block' in edit:
+                day = edit.get('day')
+                if day is not None and day not in _DAY_NAMES:
+                    raise ValueError('Unknown day {}'.format(day))
+                task['blocks'].append((self.techIndex(edit['block']),
+                                       None if day is None else _DAY_NAMES.index(day)))
+            elif 'hours' in edit:
+                task['targets'][self.techIndex(edit['hours'])] = int(edit['target'])
+            elif 'drop' in edit:
+                task['dropped'].extend(self.shiftIndices(edit['drop']))
+            else:
+                raise ValueError('Unknown edit {}'.format(json.dumps(edit)))
+
+        return task
+
+    def techIndex(self, name):
+        if name not in self.names:
+            raise ValueError('No tech named {}'.format(name))
+        return self.names[name]
+
+    def shiftIndices(self, spec):
+        start = datetime.datetime.fromisoformat(spec['start'][:19])
+        matches = [s for s, shift in enumerate(self.shifts)
+                   if shift.cal == spec['cal'] and shift.start == start]
+        if not matches:
+            raise ValueError('No shift on {} at {}'.format(spec['cal'], spec['start']))
+        return matches
+
+    def solve(self, scenarios):
+        ''' Returns the result of each scenario, the unchanged week first '''
+
+        tasks = [self.makeTask({'name': 'baseline'})]
+        tasks += [self.makeTask(scenario) for scenario in scenarios]
+
+        blocks, specs = shareArrays(self.arrays)
+        try:
+            with futures.ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    initializer=attachArrays,
+                    initargs=(specs,)) as pool:
+                results = list(pool.map(solveScenario, tasks))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        baseline = results[0]['assignment']
+        for result in results:
+            result['moved'] = sum(before is not None and before != after
+                                  for before, after in zip(baseline, result['assignment']))
+
+        return results
+
+def printResults(results):
+    ''' Prints the scenarios side by side, with changes from the baseline '''
+
+    baseline = results[0]
+    print('{:<24} {:>11} {:>11} {:>11} {:>6} {:>8}'.format(
+        'scenario', 'filled', 'deviation', 'pain', 'moved', 'seconds'))
+    for result in results:
+        cells = ['{} ({:+})'.format(result[key], result[key] - baseline[key]) if result is not baseline
+                 else str(result[key]) for key in ('filled', 'deviation', 'pain')]
+        print('{:<24} {:>11} {:>11} {:>11} {:>6} {:>8.2f}'.format(
+            result['name'][:24], *cells, result['moved'], result['seconds']))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Compares many variants of a week, solved in parallel',
+        epilog='Brought to you by Scarborough'
+    )
+    parser.add_argument('week', type=int, help='week of the quarter')
+    parser.add_argument('scenarios', help='JSON list of {"name": ..., "edits": [...]} to compare')
+    parser.add_argument('-p', '--processes', type=int, help='scenarios solved at once (every core by default)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='CP-SAT search workers per scenario')
+    parser.add_argument('-l', '--time-limit', type=float, nargs='+', help='seconds allowed per solve phase')
+    parser.add_argument('-g', '--gap', type=float, default=0.0, help='stop a phase once within this relative gap of optimal')
+    parser.add_argument('--fake', type=int, nargs=2, metavar=('TECHS', 'SHIFTS'), help='run against a synthetic shop instead of Google')
+    parser.add_argument('--from-snapshot', metavar='PATH', help='load a saved snapshot instead of fetching')
+    parser.add_argument('--sync', action='store_true', help='fetch only what changed since the last sync')
+    parser.add_argument('-o', '--output', help='also write the results as JSON')
+    parser.set_defaults(weeks=1, weighted=False, decompose=None, fast=False, dry=True,
+                        progress=None, stall=0, accept=False,
+                        repair=False, drop=[], no_cache=False)
+    args = parser.parse_args()
+
+    with open(args.scenarios) as f:
+        scenarios = json.load(f)
+
+    provider, config = None, None
+    if args.fake:
+        import shopFake
+        provider, config = shopFake.makeShop(*args.fake, week=args.week)
+    scheduler = shopScheduler.ShopScheduler(args, provider, config)
+
+    sweep = ShopSweep(
+        scheduler,
+        processes=args.processes,
+        workers=args.workers,
+        time_limits=args.time_limit,
+        gap=args.gap)
+    try:
+        results = sweep.solve(scenarios)
+    except ValueError as error:
+        sys.exit(error)
+
+    printResults(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -4,6 +4,8 @@ import datetime
 from functools import reduce
 from email.mime.text import MIMEText
 
+import numpy as np
+
 class Tech(object):
 
    __slots__ = ['first', 'last', 'nick', 'email', 'edit', 
@@ -20,7 +22,7 @@ class Tech(object):
       self.level    = row[params['col_index']['Position']]
       self.hours    = int(row[params['col_index']['Hours per Week']])
       self.shifts   = []
-      self.by_hour, self.by_day = self.parseConflicts(row, params)
+      self.by_hour, self.by_day = kwargs.get('conflicts') or self.parseConflicts(row, params)
     
    def __str__(self):
       ''' Pretty-prints information about the tech '''
@@ -34,25 +36,85 @@ class Tech(object):
          len(self.getShifts(filter='Red')),
          len(self.getShifts(filter='Yellow')))
    
+   def getState(self):
+      ''' Returns the parsed Tech as plain values for a snapshot
+
+      The conflict grids are packed eight days or hours to a byte.
+      '''
+
+      return {
+         'first': self.first,
+         'last': self.last,
+         'nick': self.nick,
+         'email': self.email,
+         'edit': self.edit,
+         'level': self.level,
+         'hours': self.hours,
+         'by_hour': np.packbits(self.by_hour).tolist(),
+         'by_day': np.packbits(self.by_day).tolist(),
+         'weeks': len(self.by_day)}
+
+   @staticmethod
+   def fromState(state):
+      ''' Rebuilds a Tech from getState without parsing a spreadsheet row '''
+
+      tech = Tech.__new__(Tech)
+      for name in ['first', 'last', 'nick', 'email', 'edit', 'level', 'hours']:
+         setattr(tech, name, state[name])
+      tech.shifts = []
+
+      unpack = lambda bits, shape: np.unpackbits(
+         np.array(bits, dtype=np.uint8))[:shape[0] * shape[1]].reshape(shape).astype(bool)
+      tech.by_hour = unpack(state['by_hour'], (7, 24))
+      tech.by_day = unpack(state['by_day'], (state['weeks'], 7))
+      return tech
+
+   def getName(self):
+      ''' Returns the name the Tech goes by on the calendar '''
+
+      return self.nick if self.nick else '{} {:1.1}'.format(self.first, self.last)
+
    def parseConflicts(self, row, params):
-      ''' Determines when the Tech is unavailabile '''
+      ''' Determines when the Tech is unavailabile
+
+      by_hour is a days x 24 grid of weekly conflicts and by_day a weeks x
+      days grid of conflicts over the quarter.
+      '''
+
+      by_hour, by_day = Tech.parseAllConflicts([row], params)
+      return by_hour[0], by_day[0]
+
+   @staticmethod
+   def parseAllConflicts(rows, params):
+      ''' Determines when every Tech on a sheet is unavailable, in one pass
 
-      by_hour = [[True for h in range(24)] for day in params['day_names']]
-      by_day = [[True for d in range(7)] for week in params['week_names']]
+      Returns techs x days x 24 and techs x weeks x days grids, whose rows
+      each Tech can view. A cell lists the days it conflicts on, and the
+      same few lists recur across a sheet, so each distinct cell is
+      matched against the day names only once.
+      '''
 
-      for h, index in enumerate(params['hour_cols'], start=params['first_hour']):
-         for d, day in enumerate(params['day_names']):
-            by_hour[d][h] = day in row[index]
+      days = params['day_names']
+      by_hour = np.ones((len(rows), len(days), 24), dtype=bool)
 
-      for w, index in enumerate(params['week_cols']):
-         for d, day in enumerate(params['day_names']):
-            by_day[w][d] = day in row[index]
+      cells = {}
+      def decode(cols):
+         codes = np.array([[cells.setdefault(row[index], len(cells)) for index in cols]
+                           for row in rows], dtype=np.intp).reshape(len(rows), len(cols))
+         masks = np.array([[day in cell for day in days] for cell in cells],
+                          dtype=bool).reshape(len(cells), len(days))
+         return masks[codes]
+
+      first = params['first_hour']
+      by_hour[:, :, first:first + len(params['hour_cols'])] = \
+         decode(params['hour_cols']).transpose(0, 2, 1)
+      by_day = decode(params['week_cols'])
 
       return by_hour, by_day
 
    def getShifts(self, **kwargs):
       ''' Returns a subset of the Tech's shifts '''
-      
+
       def match(shift):
          if 'filter' in kwargs and kwargs['filter'] not in shift.cal:
             return False
@@ -67,8 +129,8 @@ class Tech(object):
 
       return sum([shift.hours for shift in self.getShifts(**kwargs)])
 
-   def sendEmail(self, gmail):
-      ''' Notifies the Tech of their shift assignment '''
+   def composeEmail(self):
+      ''' Builds the Gmail message telling the Tech their shifts '''
 
       name = self.nick if self.nick else self.first
 
@@ -91,6 +153,10 @@ class Tech(object):
       mime['to'] = self.email
       mime['subject'] = 'Schedule for Next Week'
       encoded = base64.urlsafe_b64encode(mime.as_string().encode('utf-8'))
-      message = {'raw': encoded.decode()} 
+      return {'raw': encoded.decode()} 
+
+   def sendEmail(self, gmail, message=None):
+      ''' Notifies the Tech of their shift assignment '''
 
+      message = message or self.composeEmail()
       return gmail.users().messages().send(userId="me", body=message)
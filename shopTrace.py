@@ -0,0 +1,97 @@
+import json
+import time
+import threading
+import contextlib
+
+class Trace(object):
+
+    def __init__(self):
+        ''' Records where a run spends its time
+
+        Stages are timed blocks of work, calls are API round trips grouped
+        by name, models the size of each CP-SAT model built and phases the
+        statistics of each solve.
+        '''
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        ''' Forgets everything recorded so far and restarts the clock '''
+
+        with self.lock:
+            self.origin = time.perf_counter()
+            self.stages = []
+            self.calls = {}
+            self.models = []
+            self.phases = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        ''' Times the enclosed block as a stage '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages.append({
+                    'name': name,
+                    'start': start - self.origin,
+                    'seconds': time.perf_counter() - start})
+
+    def execute(self, name, request, **kwargs):
+        ''' Executes an API request, recording its latency and outcome '''
+
+        start = time.perf_counter()
+        error = False
+        try:
+            return request.execute(**kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.recordCall(name, time.perf_counter() - start, error)
+
+    def recordCall(self, name, seconds, error=False):
+        ''' Adds one round trip to the totals for name '''
+
+        with self.lock:
+            calls = self.calls.setdefault(name, {
+                'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            calls['calls'] += 1
+            calls['errors'] += int(error)
+            calls['seconds'] += seconds
+            calls['max_seconds'] = max(calls['max_seconds'], seconds)
+
+    def recordModel(self, name, model):
+        ''' Records the size of a CP-SAT model '''
+
+        proto = model.Proto()
+        with self.lock:
+            self.models.append({
+                'name': name,
+                'variables': len(proto.variables),
+                'constraints': len(proto.constraints)})
+
+    def recordPhase(self, phase):
+        ''' Records the statistics of one solve '''
+
+        with self.lock:
+            self.phases.append(phase)
+
+    def save(self, path):
+        ''' Writes the trace as JSON '''
+
+        with self.lock:
+            data = {
+                'stages': self.stages,
+                'calls': self.calls,
+                'models': self.models,
+                'phases': self.phases}
+
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+# Shared by every module in the run; cheap enough to always record
+trace = Trace()
@@ -0,0 +1,88 @@
+import shopModel
+import shopShift
+import shopSolver
+import shopCalendar
+import shopScheduler
+
+import argparse
+import datetime
+
+import numpy as np
+
+def makeShifts(count, hours=4):
+    ''' Shifts of the given length through the week of Monday 2018-01-01
+
+    Each day gets one in the morning before any gets a second in the
+    afternoon.
+    '''
+
+    anchor = datetime.datetime(2018, 1, 1, 8)
+    shifts = []
+    for d in range(count):
+        start = anchor + datetime.timedelta(days=d % 7, hours=6 * (d // 7))
+        end = start + datetime.timedelta(hours=hours)
+        shifts.append(shopShift.Shift({
+            'id': 'e{}'.format(d),
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': end.isoformat()},
+            'organizer': {'displayName': 'Schedule - Hangar', 'email': 'hangar'}},
+            cutoff=anchor.replace(hour=0)))
+
+    return shifts
+
+def makeScheduler(targets, shifts):
+    ''' A scheduler over the given techs and shifts, without fetching anything '''
+
+    scheduler = shopScheduler.ShopScheduler.__new__(shopScheduler.ShopScheduler)
+    scheduler.args = argparse.Namespace(
+        week=1, weeks=1, workers=1, time_limit=[10], gap=0.0, weighted=False,
+        stall=0, accept=False)
+    scheduler.progress = None
+    scheduler.roster = argparse.Namespace(
+        techs=[argparse.Namespace(hours=target) for target in targets])
+    scheduler.calendar = shopCalendar.ShopCalendar.__new__(shopCalendar.ShopCalendar)
+    scheduler.calendar.cutoff = datetime.datetime(2018, 1, 1)
+    scheduler.calendar.shifts = shifts
+
+    return scheduler
+
+def test_lone_class_keeps_weekly_limit():
+    ''' A class of one tech is held to the weekly limit like any other '''
+
+    shifts = makeShifts(10)
+    hours = [shift.hours for shift in shifts]
+    overlaps, conflicts = shopModel.ShopModel.parseConflicts(shifts)
+    class_model = shopModel.ClassModel(
+        [[0, 1], [2]], [4, 4, 8], hours, np.ones((len(hours), 3), dtype=bool),
+        shopModel.ShopModel.parseWindows(conflicts))
+    solver = shopSolver.ShopSolver(class_model, workers=1, verbose=False).solveCoverage()
+
+    worked = sum(hours[s] for s, c in enumerate(class_model.assignment(solver)) if c == 1)
+    assert worked <= 20
+
+def test_classes_mixed_with_lone_techs():
+    ''' Alike techs and a lone tech split a week without passing the limit
+
+    The alike pair can only work the afternoons, so every morning falls
+    to the lone tech, who has room for five of the seven.
+    '''
+
+    shifts = makeShifts(10)
+    scheduler = makeScheduler([4, 4, 8], shifts)
+    overlaps, conflicts = shopModel.ShopModel.parseConflicts(shifts)
+    availability = np.ones((len(shifts), 3), dtype=bool)
+    availability[:, :2] = np.array([shift.start.hour > 12 for shift in shifts])[:, None]
+
+    shop_model = scheduler.buildModel(availability, conflicts)
+    classes = shopModel.ShopModel.parseClasses([4, 4, 8], availability)
+    assert classes == [[0, 1], [2]]
+
+    assignment = scheduler.solveClasses(shop_model, classes, availability, conflicts)
+    assert assignment is not None
+    assert sum(t is not None for t in assignment) == 8
+
+    worked = [0, 0, 0]
+    for shift, t in zip(shifts, assignment):
+        if t is not None:
+            worked[t] += shift.hours
+    assert max(worked) <= 20
@@ -0,0 +1,70 @@
+import shopFake
+import shopModel
+import shopShift
+import shopRoster
+import shopHeuristic
+
+import random
+import datetime
+
+import pytest
+
+ANCHOR = datetime.datetime(2018, 1, 1)
+
+def makeWeeks(seed, techs=20, shifts=120, weeks=2):
+    ''' A synthetic shop's targets, shifts, availability and conflicts over some weeks '''
+
+    rng = random.Random(seed)
+    roster = shopRoster.ShopRoster.__new__(shopRoster.ShopRoster).parseTechs(
+        shopFake.makeRoster(techs, rng))
+    calendars = shopFake.makeEvents(shifts, ANCHOR, rng, weeks=weeks)
+    shifts = shopShift.ShiftTable.fromEvents(
+        [item for cal in calendars.values() for item in cal]).shifts()
+
+    overlaps, conflicts = shopModel.ShopModel.parseConflicts(shifts)
+    availability = shopModel.ShopModel.parseAvailability(shifts, roster)
+    targets = [tech.hours * weeks for tech in roster]
+    hours = [shift.hours for shift in shifts]
+    week = [(shift.start - ANCHOR).days // 7 for shift in shifts]
+
+    return targets, hours, availability, conflicts, week
+
+@pytest.mark.parametrize('seed', range(5))
+def test_schedule_is_feasible(seed):
+    ''' Nobody works twice in a day, past the weekly limit, or without a target '''
+
+    targets, hours, availability, conflicts, week = makeWeeks(seed)
+    assignment = shopHeuristic.ShopHeuristic(
+        targets, hours, availability, conflicts, weeks=week).solve()
+
+    assert any(t is not None for t in assignment)
+    for s, t in enumerate(assignment):
+        if t is None:
+            continue
+        assert availability[s, t]
+        assert targets[t] > 0
+        assert all(assignment[s2] != t for s2 in range(s + 1, conflicts[s]))
+
+    weekly = {}
+    for s, t in enumerate(assignment):
+        if t is not None:
+            weekly[t, week[s]] = weekly.get((t, week[s]), 0) + hours[s]
+    assert max(weekly.values()) <= 20
+
+@pytest.mark.parametrize('seed', range(5))
+def test_balance_never_adds_deviation(seed):
+    ''' Evening out hours after matching never leaves techs further from target '''
+
+    targets, hours, availability, conflicts, week = makeWeeks(seed)
+    heuristic = shopHeuristic.ShopHeuristic(
+        targets, hours, availability, conflicts, weeks=week)
+    for b in range(len(heuristic.blocks)):
+        heuristic.matchBlock(b)
+
+    deviation = lambda: sum(abs(heuristic.need(t)) for t in range(len(targets)))
+    before = deviation()
+    filled = sum(t is not None for t in heuristic.assignment)
+    heuristic.balance()
+
+    assert sum(t is not None for t in heuristic.assignment) >= filled
+    assert deviation() <= before
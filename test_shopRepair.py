@@ -0,0 +1,23 @@
+import shopModel
+import shopSolver
+
+import numpy as np
+
+def test_repair_fills_past_target_within_limit():
+    ''' A tech who has met their target still takes a freed shift they have room for '''
+
+    shop_model = shopModel.ShopModel.repairModel(
+        [10], [10, 4], [0, None], [1], np.ones((2, 1), dtype=bool), [1, 2])
+    solver = shopSolver.ShopSolver(shop_model, workers=1, verbose=False).solveRepair([None])
+
+    assert shop_model.assignment(solver) == [0]
+    assert solver.Value(shop_model.deviation) == 4
+
+def test_repair_keeps_no_work_for_zero_target():
+    ''' A tech with no target is still kept off freed shifts '''
+
+    shop_model = shopModel.ShopModel.repairModel(
+        [0], [4], [None], [0], np.ones((1, 1), dtype=bool), [1])
+    solver = shopSolver.ShopSolver(shop_model, workers=1, verbose=False).solveRepair([None])
+
+    assert shop_model.assignment(solver) == [None]
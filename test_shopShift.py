@@ -0,0 +1,107 @@
+import shopFake
+import shopTech
+import shopShift
+import shopRoster
+import shopSnapshot
+
+import random
+import datetime
+
+import numpy as np
+
+ANCHOR = datetime.datetime(2018, 1, 1)
+
+def makeItems(count, seed=0):
+    ''' Events from every fake calendar, all-day and organizer-less ones included '''
+
+    calendars = shopFake.makeEvents(count, ANCHOR, random.Random(seed))
+    items = [item for cal in calendars.values() for item in cal]
+    orphan = dict(items[0], id='orphan')
+    del orphan['organizer']
+    return items + [orphan]
+
+def oldConflicts(row, params):
+    ''' Parses one row's conflicts cell by cell, as Tech once did '''
+
+    by_hour = np.ones((len(params['day_names']), 24), dtype=bool)
+    by_day = np.ones((len(params['week_names']), 7), dtype=bool)
+    for h, index in enumerate(params['hour_cols'], start=params['first_hour']):
+        for d, day in enumerate(params['day_names']):
+            by_hour[d][h] = day in row[index]
+    for w, index in enumerate(params['week_cols']):
+        for d, day in enumerate(params['day_names']):
+            by_day[w][d] = day in row[index]
+    return by_hour, by_day
+
+def test_table_matches_shift_per_event():
+    ''' Shifts parsed as one table read the same as shifts parsed one by one '''
+
+    items = makeItems(60)
+    cutoff = ANCHOR + datetime.timedelta(days=3)
+    shifts = shopShift.ShiftTable.fromEvents(items).shifts(cutoff=cutoff)
+
+    expected = []
+    for item in items:
+        try:
+            expected.append(shopShift.Shift(item, cutoff=cutoff))
+        except KeyError:
+            continue
+
+    assert len(shifts) == len(expected) == 60
+    for shift, other in zip(shifts, expected):
+        assert shift.event is other.event
+        assert (shift.start, shift.end, shift.hours, shift.cal, shift.old) == \
+            (other.start, other.end, other.hours, other.cal, other.old)
+        assert str(shift) == str(other)
+
+def test_sheet_conflicts_match_row_by_row():
+    ''' Conflicts parsed for the whole sheet match parsing each row alone '''
+
+    values = shopFake.makeRoster(25, random.Random(0))
+    header = values[0]
+    params = {
+        'hour_cols': [i for i, n in enumerate(header) if n.startswith('Conflicts by Week')],
+        'week_cols': [i for i, n in enumerate(header) if n.startswith('Conflicts by Quarter')],
+        'first_hour': 7,
+        'day_names': ['Monday', 'Tuesday', 'Wednesday', 'Thursday',
+                      'Friday', 'Saturday', 'Sunday']}
+    params['week_names'] = [header[i] for i in params['week_cols']]
+
+    roster = shopRoster.ShopRoster.__new__(shopRoster.ShopRoster)
+    techs = roster.parseTechs(values)
+    by_hour, by_day = shopTech.Tech.parseAllConflicts(values[1:], params)
+
+    assert len(techs) == 25
+    for t, (tech, row) in enumerate(zip(techs, values[1:])):
+        old_hour, old_day = oldConflicts(row, params)
+        assert np.array_equal(by_hour[t], old_hour)
+        assert np.array_equal(by_day[t], old_day)
+        assert np.array_equal(tech.by_hour, old_hour)
+        assert np.array_equal(tech.by_day, old_day)
+
+def test_snapshot_round_trip(tmp_path):
+    ''' Shifts and techs read back from a snapshot file match those saved '''
+
+    items = makeItems(30)
+    shifts = shopShift.ShiftTable.fromEvents(items).shifts(
+        cutoff=ANCHOR + datetime.timedelta(days=3))
+    shifts[0].tech = 'Tech0'
+    techs = shopRoster.ShopRoster.__new__(shopRoster.ShopRoster).parseTechs(
+        shopFake.makeRoster(5, random.Random(0)))
+
+    path = str(tmp_path / 'snapshot.json.gz')
+    shopSnapshot.saveState(path, {
+        'shifts': [shift.getState() for shift in shifts],
+        'techs': [tech.getState() for tech in techs]})
+    state = shopSnapshot.loadState(path)
+
+    loaded = shopShift.Shift.fromStates(state['shifts'])
+    for shift, other in zip(shifts, loaded):
+        assert shift.event == other.event
+        assert (shift.start, shift.end, shift.hours, shift.cal, shift.old, shift.tech) == \
+            (other.start, other.end, other.hours, other.cal, other.old, other.tech)
+
+    for tech, other in zip(techs, map(shopTech.Tech.fromState, state['techs'])):
+        assert (tech.getName(), tech.hours) == (other.getName(), other.hours)
+        assert np.array_equal(tech.by_hour, other.by_hour)
+        assert np.array_equal(tech.by_day, other.by_day)
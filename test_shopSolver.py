@@ -0,0 +1,41 @@
+import shopModel
+import shopSolver
+
+import numpy as np
+
+def makeModel():
+    ''' Two techs and three shifts on separate days, one of which nobody can work '''
+
+    availability = np.array([[True, True], [True, False], [False, False]])
+    return shopModel.ShopModel(
+        [8, 4], [4, 4, 4], availability, shopModel.ShopModel.parseWindows([1, 2, 3]))
+
+def test_progress_records_each_solution():
+    ''' Every improving solution is reported with its phase, bound and open shifts '''
+
+    records = []
+    shop_model = makeModel()
+    solver = shopSolver.ShopSolver(
+        shop_model, workers=1, verbose=False, progress=records.append).solveCoverage()
+
+    assert records
+    assert {record['phase'] for record in records} == {'filled', 'deviation'}
+    for record in records:
+        assert set(record) == {'phase', 'seconds', 'objective', 'bound', 'gap', 'unfilled'}
+        assert record['gap'] >= 0
+    assert records[-1]['unfilled'] == 3 - solver.Value(shop_model.filled) == 1
+
+def test_accepted_keeps_previous_schedule():
+    ''' Once a schedule is accepted, later phases return it without solving '''
+
+    records = []
+    shop_model = makeModel()
+    shop_solver = shopSolver.ShopSolver(
+        shop_model, workers=1, verbose=False, progress=records.append)
+    solver = shop_solver.solveCoverage()
+    solved = len(records), len(shop_solver.phases)
+
+    shop_solver.accepted = True
+    assert shop_solver.solveSpread(0) is solver
+    assert shop_solver.solvePhase(1, shop_model.deviation) is solver
+    assert (len(records), len(shop_solver.phases)) == solved